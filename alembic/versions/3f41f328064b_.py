@@ -0,0 +1,34 @@
+"""Index device_login expires_at
+
+Revision ID: 3f41f328064b
+Revises: fcebac6614cb
+Create Date: 2026-10-18 19:02:11.530117
+
+"""
+
+from alembic import op
+
+from app.core.config import settings
+
+# revision identifiers, used by Alembic.
+revision: str = "3f41f328064b"
+down_revision = "fcebac6614cb"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        op.f("ix_device_login_expires_at"),
+        "device_login",
+        ["expires_at"],
+        schema=settings.SCHEMA_NAME,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f("ix_device_login_expires_at"),
+        table_name="device_login",
+        schema=settings.SCHEMA_NAME,
+    )
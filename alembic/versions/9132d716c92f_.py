@@ -0,0 +1,45 @@
+"""Widen device_login session_id to BIGINT
+
+Revision ID: 9132d716c92f
+Revises: 3f41f328064b
+Create Date: 2026-10-18 19:31:52.806344
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.core.config import settings
+
+# revision identifiers, used by Alembic.
+revision: str = "9132d716c92f"
+down_revision = "3f41f328064b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.alter_column(
+        "device_login",
+        "session_id",
+        existing_type=sa.INTEGER(),
+        type_=sa.BIGINT(),
+        existing_nullable=False,
+        schema=settings.SCHEMA_NAME,
+    )
+
+
+def downgrade() -> None:
+    # Random session ids don't fit in an INTEGER, these sessions are lost
+    op.execute(
+        f"DELETE FROM {settings.SCHEMA_NAME}.device_login"
+        " WHERE session_id > 2147483647"
+    )
+    op.alter_column(
+        "device_login",
+        "session_id",
+        existing_type=sa.BIGINT(),
+        type_=sa.INTEGER(),
+        existing_nullable=False,
+        schema=settings.SCHEMA_NAME,
+    )
@@ -0,0 +1,55 @@
+"""GIN indexes on user tags and roles
+
+Revision ID: fcebac6614cb
+Revises: e63d7af6ac9f
+Create Date: 2026-10-18 18:12:40.118204
+
+"""
+
+from alembic import op
+
+from app.core.config import settings
+
+# revision identifiers, used by Alembic.
+revision: str = "fcebac6614cb"
+down_revision = "e63d7af6ac9f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Built without locking out writes, which CREATE INDEX CONCURRENTLY can't
+    # do inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f("ix_user_tags"),
+            "user",
+            ["tags"],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+            schema=settings.SCHEMA_NAME,
+        )
+        op.create_index(
+            op.f("ix_user_roles"),
+            "user",
+            ["roles"],
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+            schema=settings.SCHEMA_NAME,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            op.f("ix_user_roles"),
+            table_name="user",
+            postgresql_concurrently=True,
+            schema=settings.SCHEMA_NAME,
+        )
+        op.drop_index(
+            op.f("ix_user_tags"),
+            table_name="user",
+            postgresql_concurrently=True,
+            schema=settings.SCHEMA_NAME,
+        )
@@ -1,30 +1,35 @@
-from urllib import request
 from fastapi import Depends, HTTPException, status
 from fastapi.responses import JSONResponse, Response
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel, ValidationError
-from jose import JWTError, jwt
+import jwt
 from datetime import datetime, timezone
-from typing import Annotated, Any, Dict, List, Literal, Optional, Set, Union
+from typing import Annotated, Any, Dict, List, Literal, Optional, Set, Tuple, Union
 from loguru import logger
-from jwt.algorithms import RSAAlgorithm
+from hashlib import sha256
+import secrets
+import time
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, SecurityScopes
-import requests
 from app.models.user import User
 from app.models.device_login import DeviceLogin
 from app.schemas.user import ScopeEnum
 from app.core.config import settings
+from app.core.signing import TokenError, TokenSigner, unverified_claims
+from app.api.firebase_keys import firebase_keys
+from app.cache import Denylist, TTLCache
+from app.metrics import cache_collector, timed
 from app import crud
 
 ACCESS_TOKEN_TYPE: str = "access"
 REFRESH_TOKEN_TYPE: str = "refresh"
 
-with open(settings.JWT_SECRET_KEY_PATH) as f:
-    private_key = f.read()
-
-with open(settings.JWT_PUBLIC_KEY_PATH) as f:
-    public_key = f.read()
+signer = TokenSigner.from_files(
+    settings.JWT_ALGORITHM,
+    settings.JWT_SECRET_KEY_PATH,
+    settings.JWT_PUBLIC_KEY_PATH,
+    settings.JWT_KEYRING_PATHS,
+)
 
 auth_response: Dict[Union[int, str], Dict[str, Any]] = {
     401: {"description": "Not Authenticated"},
@@ -50,64 +55,64 @@ class Token(BaseModel):
     token_type: str
 
 
+@timed("create_token")
 def create_token(payload: dict[str, Any]) -> str:
-    encoded_jwt = jwt.encode(payload, private_key, algorithm=settings.JWT_ALGORITHM)
-    return encoded_jwt
+    return signer.sign(payload)
 
 
-def verify_firebasetoken(token: str) -> dict[str, Any]:
+@timed("verify_firebasetoken")
+async def verify_firebasetoken(token: str) -> dict[str, Any]:
     try:
-        response = requests.get(
-            "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
-        )
-        keys = response.json()
         unverified_header = jwt.get_unverified_header(token)
         key_id = unverified_header["kid"]
+    except (TokenError, KeyError):
+        raise HTTPException(status_code=401, detail="Invalid token")
 
-        if key_id not in keys:
-            raise HTTPException(status_code=401, detail="Invalid token")
+    key = await firebase_keys.get_key(key_id)
+    if key is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
 
-        decoded_token = jwt.get_unverified_claims(token)
+    try:
+        # Audience, issuer and iat are checked below to keep the specific
+        # messages
+        decoded_token = jwt.decode(
+            token,
+            key,
+            algorithms=["RS256"],
+            options={"verify_aud": False, "verify_iss": False, "verify_iat": False},
+        )
         exp = decoded_token["exp"]
         iat = decoded_token["iat"]
         aud = decoded_token["aud"]
         iss = decoded_token["iss"]
         sub = decoded_token["sub"]
         auth_time = decoded_token["auth_time"]
-
-        localtime = datetime.now(timezone.utc)
-
-        if exp < localtime.timestamp():
-            raise HTTPException(status_code=401, detail="Token has expired")
-        if iat > localtime.timestamp():
-            raise HTTPException(status_code=401, detail="Token issued in the future")
-        if aud != settings.FIREBASE_PROJECT_ID:
-            raise HTTPException(status_code=401, detail="Invalid audience")
-        if iss != f"https://securetoken.google.com/{settings.FIREBASE_PROJECT_ID}":
-            raise HTTPException(status_code=401, detail="Invalid issuer")
-        if not sub:
-            raise HTTPException(status_code=401, detail="Anonymous user")
-        if auth_time > localtime.timestamp():
-            raise HTTPException(status_code=401, detail="Invalid authentication time")
-
-        return decoded_token
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Signature has expired")
-    except jwt.JWTClaimsError:
+    except (TokenError, KeyError):
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    localtime = datetime.now(timezone.utc)
+
+    if exp < localtime.timestamp():
+        raise HTTPException(status_code=401, detail="Token has expired")
+    if iat > localtime.timestamp():
+        raise HTTPException(status_code=401, detail="Token issued in the future")
+    if aud != settings.FIREBASE_PROJECT_ID:
+        raise HTTPException(status_code=401, detail="Invalid audience")
+    if iss != f"https://securetoken.google.com/{settings.FIREBASE_PROJECT_ID}":
+        raise HTTPException(status_code=401, detail="Invalid issuer")
+    if not sub:
+        raise HTTPException(status_code=401, detail="Anonymous user")
+    if auth_time > localtime.timestamp():
+        raise HTTPException(status_code=401, detail="Invalid authentication time")
+
+    return decoded_token
 
+
+@timed("decode_token")
 def decode_token(token: str) -> dict[str, Any]:
-    return jwt.decode(
-        token,
-        public_key,
-        algorithms=[settings.JWT_ALGORITHM],
-        options={
-            "require_exp": True,
-            "require_iat": True,
-            "require_sub": True,
-        },
-    )
+    return signer.verify(token, require=["exp", "iat", "sub"])
 
 
 class AuthData(BaseModel):
@@ -117,6 +122,34 @@ class AuthData(BaseModel):
     tags: List[str]
 
 
+# Verified access tokens, by hash, until they expire. Clients present the
+# same token on every request for its whole lifetime, so this spares the
+# signature verification on all but the first.
+access_tokens: TTLCache[bytes, AuthData] = TTLCache(
+    settings.ACCESS_TOKEN_CACHE_MAX_ENTRIES, ttl=0
+)
+# Tokens revoked before their `exp`, kept until they would have expired.
+# Never evicted, however many there are, unlike the cache above.
+revoked_access_tokens: Denylist[bytes] = Denylist()
+cache_collector.register("access_token", access_tokens)
+
+
+def _token_key(token: str) -> bytes:
+    return sha256(token.encode()).digest()
+
+
+def revoke_access_token(token: str) -> None:
+    """Reject `token` from now on, even though it has not expired yet"""
+    try:
+        exp = unverified_claims(token)["exp"]
+    except (TokenError, KeyError):
+        return
+
+    key = _token_key(token)
+    revoked_access_tokens.add(key, ttl=exp - time.time())
+    access_tokens.invalidate(key)
+
+
 async def get_auth_data(
     cred: str = Depends(secure),
 ) -> Optional[AuthData]:
@@ -126,10 +159,19 @@ async def get_auth_data(
     if token is None:
         return None
 
+    key = _token_key(token)
+    auth_data = access_tokens.get(key)
+    if auth_data is not None:
+        return auth_data
+    if key in revoked_access_tokens:
+        return None
+    # A revocation while the token is verified must not be undone below
+    version = access_tokens.version
+
     try:
         payload = decode_token(token)
         token_type = payload["type"]
-    except JWTError:
+    except TokenError:
         return None
 
     if token_type != ACCESS_TOKEN_TYPE:
@@ -141,6 +183,7 @@ async def get_auth_data(
         logger.debug(e)
         return None
 
+    access_tokens.set(key, auth_data, ttl=payload["exp"] - time.time(), version=version)
     return auth_data
 
 
@@ -180,28 +223,29 @@ async def verify_token(
     return auth_data
 
 
-def generate_response(
-    db: Session,
-    user: User,
-    device_login: DeviceLogin | None = None,
-) -> Response:
-
+async def generate_response(db: AsyncSession, user: User) -> Response:
+    """Open a new session for `user` and hand out its tokens"""
     iat = datetime.now(timezone.utc)
+    # Sessions are stored as naive UTC timestamps
+    now = iat.replace(tzinfo=None)
+
+    device_login = DeviceLogin(
+        user_id=user.uid,
+        # Random rather than derived from the time so that concurrent logins
+        # of the same user can't collide, 63 bits to fit a signed BIGINT
+        session_id=secrets.randbits(63),
+        refreshed_at=now,
+        expires_at=now + settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+    )
+    db.add(device_login)
+    await db.commit()
 
-    if device_login is None:
-        device_login = DeviceLogin(
-            user_id=user.uid,
-            session_id=int(iat.timestamp()),
-            refreshed_at=iat,
-            expires_at=iat + settings.ACCESS_TOKEN_EXPIRE_MINUTES,
-        )
-        db.add(device_login)
-    else:
-        device_login.refreshed_at = iat
-        device_login.expires_at = iat + settings.ACCESS_TOKEN_EXPIRE_MINUTES
+    return _token_response(user, device_login.session_id, iat, device_login.expires_at)
 
-    db.commit()
 
+def _token_response(
+    user: User, session_id: int, iat: datetime, expires_at: datetime
+) -> Response:
     access_token = create_token(
         {
             "sub": user.uid,
@@ -215,13 +259,14 @@ def generate_response(
         }
     )
 
+    expires_at = expires_at.replace(tzinfo=timezone.utc)
     refresh_token = create_token(
         {
             "iat": iat,
-            "exp": device_login.expires_at,
+            "exp": expires_at,
             "sub": user.uid,
             "type": REFRESH_TOKEN_TYPE,
-            "sid": device_login.session_id,
+            "sid": session_id,
         }
     )
 
@@ -230,7 +275,7 @@ def generate_response(
     response.set_cookie(
         key="refresh",
         value=refresh_token,
-        expires=device_login.expires_at.astimezone(timezone.utc),
+        expires=expires_at,
         httponly=True,
         secure=settings.PRODUCTION,
         samesite="strict",
@@ -238,66 +283,86 @@ def generate_response(
     return response
 
 
-def _validate_refresh_token(db, token):
-    credentials_exception = HTTPException(
+def _invalid_refresh_token() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Refresh"},
     )
 
+
+def _decode_refresh_token(token: Optional[str]) -> Tuple[str, int, datetime]:
+    """User id, session id and naive UTC issue date of a refresh token"""
     if token is None:
-        raise credentials_exception
+        raise _invalid_refresh_token()
 
     try:
         payload = decode_token(token)
-        print(payload)
         # Extract all needed fields inside a `try` in case a token
         # has a bad payload.
         user_id = payload["sub"]
         session_id = int(payload["sid"])
-        issued_at = payload["iat"]
+        issued_at = datetime.fromtimestamp(payload["iat"], timezone.utc)
         token_type = payload["type"]
-    except (JWTError, ValueError, KeyError):
-        raise credentials_exception
+    except (TokenError, ValueError, KeyError, TypeError):
+        raise _invalid_refresh_token()
     # Check that the token is a refresh token
     if token_type != REFRESH_TOKEN_TYPE:
-        raise credentials_exception
+        raise _invalid_refresh_token()
+
+    return user_id, session_id, issued_at.replace(tzinfo=None)
 
-    # Get the token's session from the database
-    device_login = db.get(DeviceLogin, (user_id, session_id))
-    if device_login is None:
-        raise credentials_exception
 
+def _log_rejected_session(
+    device_login: DeviceLogin, issued_at: datetime, now: datetime
+) -> None:
     # Safety check that the session hasn't expired, the token should already
     # encode this.
-    if device_login.expires_at < datetime.now():
-        logger.warning(f"Token that should be expired was accepted")
-        # Remove the device login from the database since it's no longer used
-        db.delete(device_login)
-        db.commit()
-
-        raise credentials_exception
+    if device_login.expires_at < now:
+        logger.warning("Token that should be expired was accepted")
+    # A token issued before the last refresh might mean someone got the token
+    # and is trying to replay it
+    elif device_login.refreshed_at.replace(microsecond=0) > issued_at:
+        logger.warning("A refresh token was resubmitted")
 
-    # Check that this token issue date isn't before the last token refresh, if
-    # this happens it might mean someone got the token and is trying to replay it
-    if int(device_login.refreshed_at.timestamp()) > issued_at:
-        logger.warning(f"A refresh token was resubmitted")
-        # Preemptively remove the device login in order to prevent the token
-        # from being used by a malicious third party.
-        db.delete(device_login)
-        db.commit()
 
-        raise credentials_exception
+async def refresh_session(db: AsyncSession, token: Optional[str]) -> Response:
+    """Exchange a refresh token for new tokens of the same session"""
+    user_id, session_id, issued_at = _decode_refresh_token(token)
 
-    user = crud.user.get(db, user_id)
+    iat = datetime.now(timezone.utc)
+    now = iat.replace(tzinfo=None)
+    expires_at = now + settings.ACCESS_TOKEN_EXPIRE_MINUTES
+    user = await crud.device_login.arotate(
+        db,
+        user_id=user_id,
+        session_id=session_id,
+        issued_at=issued_at,
+        refreshed_at=now,
+        expires_at=expires_at,
+    )
     if user is None:
-        # The user no longer exists so the device login is no longer useful.
-        db.delete(device_login)
-        db.commit()
+        # The session is unknown, expired, or the token was replayed. Remove
+        # whatever is left of it so that the token can't be used by a
+        # malicious third party.
+        device_login = await crud.device_login.adelete(db, id=(user_id, session_id))
+        await db.commit()
+        if device_login is not None:
+            _log_rejected_session(device_login, issued_at, now)
+        raise _invalid_refresh_token()
+
+    await db.commit()
+    return _token_response(user, session_id, iat, expires_at)
 
-        raise credentials_exception
 
-    return user, device_login
+async def revoke_session(db: AsyncSession, token: Optional[str]) -> None:
+    """End the session of a refresh token"""
+    user_id, session_id, _ = _decode_refresh_token(token)
+
+    device_login = await crud.device_login.adelete(db, id=(user_id, session_id))
+    await db.commit()
+    if device_login is None:
+        raise _invalid_refresh_token()
 
 
 class OperationSuccess(BaseModel):
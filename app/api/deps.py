@@ -1,5 +1,5 @@
 from sqlalchemy.exc import SQLAlchemyError
-from app.db.session import SessionLocal
+from app.db.session import AsyncSessionLocal, SessionLocal
 from fastapi import HTTPException, Request
 from pydantic import BaseModel, Field
 
@@ -16,3 +16,15 @@ def get_db():
         raise
     finally:
         db.close()
+
+
+async def get_async_db():
+    db = AsyncSessionLocal()
+    try:
+        yield db
+        await db.commit()
+    except SQLAlchemyError:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
@@ -0,0 +1,99 @@
+import asyncio
+import re
+import time
+from typing import Dict, Optional
+
+import httpx
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from loguru import logger
+
+from app.core.config import settings
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class FirebaseKeyStore:
+    """In-memory store of the certificates that sign Firebase ID tokens.
+
+    The certificate set is fetched once and kept as parsed key objects. Once the
+    `Cache-Control` max-age of the last response runs out, lookups keep serving
+    the cached keys while a refresh runs in the background. Concurrent callers
+    always share a single in-flight refresh, and a failed refresh is retried
+    after `min_refresh_interval`.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        default_max_age: float = 3600,
+        min_refresh_interval: float = 60,
+        timeout: float = 5,
+    ):
+        self.url = url
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys: Dict[str, RSAPublicKey] = {}
+        self._expires_at = 0.0
+        self._fetched_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def get_key(self, kid: str) -> Optional[RSAPublicKey]:
+        key = self._keys.get(kid)
+        now = time.monotonic()
+
+        if key is not None:
+            if now >= self._expires_at:
+                self._start_refresh()
+            return key
+
+        # Unknown key id, either the store is empty or Google rotated its keys.
+        # Only wait for a refresh if we haven't fetched the keys very recently,
+        # otherwise garbage `kid`s could be used to hammer the endpoint.
+        if (
+            self._fetched_at is None
+            or now - self._fetched_at >= self.min_refresh_interval
+        ):
+            await asyncio.shield(self._start_refresh())
+            return self._keys.get(kid)
+
+        return None
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return self._refresh_task
+
+    async def _refresh(self) -> None:
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                response = await client.get(self.url)
+                response.raise_for_status()
+
+            keys = {
+                kid: x509.load_pem_x509_certificate(cert.encode()).public_key()
+                for kid, cert in response.json().items()
+            }
+        except Exception as e:
+            logger.error(f"Failed to refresh the Firebase signing keys: {e}")
+            now = time.monotonic()
+            self._fetched_at = now
+            # Keep serving the keys we have and retry later, not on every
+            # lookup while Google is unreachable
+            self._expires_at = now + self.min_refresh_interval
+            return
+
+        max_age = self.default_max_age
+        match = _MAX_AGE_RE.search(response.headers.get("cache-control", ""))
+        if match is not None:
+            max_age = int(match.group(1))
+
+        now = time.monotonic()
+        self._keys = keys
+        self._fetched_at = now
+        self._expires_at = now + max_age
+
+
+firebase_keys = FirebaseKeyStore(settings.FIREBASE_CERTS_URL)
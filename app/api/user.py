@@ -1,4 +1,4 @@
-from requests import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.api import deps, auth_deps
 from fastapi import (
     APIRouter,
@@ -11,16 +11,34 @@ from fastapi import (
     File,
     UploadFile,
     Request,
+    Query,
 )
 from loguru import logger
+import orjson
+from tempfile import TemporaryFile
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
-from typing import List, Optional
-from jose import JWTError, jwt
+from typing import Dict, List, Optional, Union
 from app import crud
 from app.schemas import UserCreate
-
-from app.schemas.user import ScopeEnum, UserInDB, UserUpdate
+from app.crud.base import BadCursor, UnknownField
+from app.db import user_import
+from app.db.user_import import ImportFormat, ImportSummary
+
+from app.schemas.user import (
+    MatchEnum,
+    ScopeEnum,
+    UserBatch,
+    UserBatchRequest,
+    UserInDB,
+    UserPage,
+    UserPublic,
+    UserPublicPage,
+    UserUpdate,
+    serialize_user_public,
+    serialize_user_record,
+)
 from app.core.config import settings
 
 router = APIRouter()
@@ -37,6 +55,8 @@ class RegisterData(BaseModel):
 
 bearer_scheme = auth_deps.FirebaseToken(auto_error=False)
 
+PUBLIC_FIELDS = crud.user.projection(UserPublic.model_fields)
+
 
 @router.post(
     "/register",
@@ -48,7 +68,7 @@ bearer_scheme = auth_deps.FirebaseToken(auto_error=False)
 )
 async def register_endpoint(
     *,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
     user_in: RegisterData,
     credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
 ):
@@ -56,16 +76,11 @@ async def register_endpoint(
     id_token = credentials.credentials
 
     # Decode the JWT token
-    decoded_token = auth_deps.verify_firebasetoken(id_token)
+    decoded_token = await auth_deps.verify_firebasetoken(id_token)
 
     # Token is valid; now you can use the decoded_token
     uid = decoded_token["user_id"]
 
-    maybe_user = crud.user.get(db, id=uid)
-
-    if maybe_user is not None:
-        raise HTTPException(status_code=400, detail="User already exists")
-
     userin = UserCreate(
         uid=uid,
         email=user_in.email,
@@ -78,10 +93,12 @@ async def register_endpoint(
         image=settings.DEFAULT_USER_IMAGE,
     )
 
-    user = crud.user.create(db, obj_in=userin)
+    # Create the user in the database, its session is committed along with it
+    user = await crud.user.acreate_if_absent(db, obj_in=userin)
+    if user is None:
+        raise HTTPException(status_code=400, detail="User already exists")
 
-    # Create the user in the database
-    return auth_deps.generate_response(db, user)
+    return await auth_deps.generate_response(db, user)
 
 
 @router.post(
@@ -93,31 +110,215 @@ async def register_endpoint(
     },
 )
 async def get_user_by_token(
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
     credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
 ):
     # Remove 'Bearer ' from the Authorization header
     id_token = credentials.credentials
 
     # Decode the JWT token
-    decoded_token = auth_deps.verify_firebasetoken(id_token)
+    decoded_token = await auth_deps.verify_firebasetoken(id_token)
 
     # Token is valid; now you can use the decoded_token
     uid = decoded_token["user_id"]
     # Get the user from the database
-    user = crud.user.get(db, id=uid)
+    user = await crud.user.aget(db, id=uid)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return auth_deps.generate_response(db, user)
+    return await auth_deps.generate_response(db, user)
+
+
+@router.get(
+    "/",
+    response_model=UserPage,
+    responses={400: {"description": "Invalid cursor"}},
+)
+async def list_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=settings.USER_PAGE_MAX_SIZE),
+    roles: List[str] = Query(default=[]),
+    tags: List[str] = Query(default=[]),
+    verified: Optional[bool] = None,
+    db: AsyncSession = Depends(deps.get_async_db),
+    payload: auth_deps.AuthData = Security(
+        auth_deps.verify_token, scopes=[ScopeEnum.ADMIN]
+    ),
+):
+    filters = crud.user.filters(roles=roles, tags=tags, verified=verified)
+    return await _users_page(db, cursor, limit, filters)
 
 
-@router.get("/{user_id}")
-async def get_user_by_id(user_id: str, db: Session = Depends(deps.get_db)):
-    user = crud.user.get(db, id=user_id)
+@router.get(
+    "/search",
+    response_model=Union[UserPage, UserPublicPage],
+    responses={400: {"description": "Invalid cursor or no role or tag given"}},
+)
+async def search_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=settings.USER_PAGE_MAX_SIZE),
+    roles: List[str] = Query(default=[]),
+    tags: List[str] = Query(default=[]),
+    match: MatchEnum = MatchEnum.ALL,
+    db: AsyncSession = Depends(deps.get_async_db),
+    payload: auth_deps.AuthData = Security(auth_deps.verify_token, scopes=[]),
+):
+    """Users with the given roles or tags.
+
+    Only admins get the full records, anyone else gets the public fields.
+    """
+    # Listing every user is left to admins, see `list_users`
+    if not roles and not tags:
+        raise HTTPException(status_code=400, detail="No role or tag given")
+
+    filters = crud.user.filters(roles=roles, tags=tags, match=match)
+    page = await _users_page(db, cursor, limit, filters)
+    if ScopeEnum.ADMIN in payload.scopes:
+        return UserPage.model_validate(page, from_attributes=True)
+    return UserPublicPage.model_validate(page, from_attributes=True)
+
+
+async def _users_page(
+    db: AsyncSession, cursor: Optional[str], limit: int, filters
+) -> Dict:
+    try:
+        after = crud.user.decode_cursor(cursor) if cursor is not None else None
+    except BadCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Fetch one extra row to know whether there is a next page
+    users = await crud.user.aget_multi(
+        db, after=after, limit=limit + 1, filters=filters
+    )
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = crud.user.cursor(users[-1])
+    return {"items": users, "next_cursor": next_cursor}
+
+
+@router.post(
+    "/import",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "description": "A line per rejected row, then the summary",
+            "content": {"application/x-ndjson": {}},
+        },
+        400: {"description": "Unknown format"},
+    },
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                content_type: {"schema": {"type": "string"}}
+                for content_type in user_import.CONTENT_TYPES
+            },
+        }
+    },
+)
+async def bulk_import(
+    request: Request,
+    format: Optional[ImportFormat] = None,
+    db: AsyncSession = Depends(deps.get_async_db),
+    payload: auth_deps.AuthData = Security(
+        auth_deps.verify_token, scopes=[ScopeEnum.ADMIN]
+    ),
+):
+    """Import users from a CSV or NDJSON body, see `app.db.user_import`.
+
+    The format is given by `format` or else the content type.
+    """
+    fmt = format or ImportFormat.from_content_type(
+        request.headers.get("content-type", "")
+    )
+    if fmt is None:
+        raise HTTPException(status_code=400, detail="Unknown format")
+
+    # Written to disk, the rows are read back from it while the errors are
+    # streamed. The file must outlive the request handler. Not spooled in
+    # memory: TextIOWrapper can't wrap a SpooledTemporaryFile before 3.11.
+    body = TemporaryFile()
+    try:
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+    rows = user_import.READERS[fmt](body)
+    # Chunks are committed on their own, the request's session isn't used
+    engine = db.bind
+
+    async def report():
+        summary = ImportSummary()
+        try:
+            async for error in user_import.import_users(engine, rows, summary):
+                yield user_import.dumps(error)
+        finally:
+            body.close()
+        yield user_import.dumps(summary)
+
+    return StreamingResponse(report(), media_type="application/x-ndjson")
+
+
+@router.post("/batch", response_model=UserBatch)
+async def get_users_by_id(
+    batch: UserBatchRequest, db: AsyncSession = Depends(deps.get_async_db)
+):
+    ids = list(dict.fromkeys(batch.ids))
+    users = {user.uid: user for user in await crud.user.aget_many(db, ids)}
+    return {
+        "users": [users[uid] for uid in ids if uid in users],
+        "missing": [uid for uid in ids if uid not in users],
+    }
+
+
+@router.get(
+    "/{user_id}",
+    response_class=Response,
+    responses={
+        200: {"model": UserInDB, "content": {"application/json": {}}},
+        400: {"description": "Unknown field"},
+        404: {"description": "User not found"},
+    },
+)
+async def get_user_by_id(
+    user_id: str,
+    fields: List[str] = Query(
+        default=[], description="Only return these fields, all by default"
+    ),
+    db: AsyncSession = Depends(deps.get_async_db),
+):
+    try:
+        projection = crud.user.projection(fields) if fields else None
+    except UnknownField as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user = await crud.user.aget_record(db, id=user_id, fields=projection)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    # The record is serialized as is, skipping jsonable_encoder
+    if projection is not None:
+        return Response(orjson.dumps(user), media_type="application/json")
+    return Response(serialize_user_record(user), media_type="application/json")
+
+
+@router.get(
+    "/{user_id}/public",
+    response_class=Response,
+    responses={
+        200: {"model": UserPublic, "content": {"application/json": {}}},
+        404: {"description": "User not found"},
+    },
+)
+async def get_public_user_by_id(
+    user_id: str, db: AsyncSession = Depends(deps.get_async_db)
+):
+    user = await crud.user.aget_record(db, id=user_id, fields=PUBLIC_FIELDS)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return Response(serialize_user_public(user), media_type="application/json")
 
 
 @router.post(
@@ -127,17 +328,14 @@ async def get_user_by_id(user_id: str, db: Session = Depends(deps.get_db)):
 )
 async def logout(
     response: Response,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
     refresh: str | None = Cookie(default=None),
 ):
     # remove the refresh token cookie from the client
     response.delete_cookie("refresh")
 
-    _, device_login = auth_deps._validate_refresh_token(db, refresh)
-
     # invalidate the user's token and clear it from the server-side
-    db.delete(device_login)
-    db.commit()
+    await auth_deps.revoke_session(db, refresh)
 
     return auth_deps.OperationSuccess(
         status="success", message="You have been logged out."
@@ -150,28 +348,35 @@ async def logout(
     response_model=auth_deps.Token,
 )
 async def refresh(
-    db: Session = Depends(deps.get_db), refresh: str | None = Cookie(default=None)
+    db: AsyncSession = Depends(deps.get_async_db),
+    refresh: str | None = Cookie(default=None),
 ):
-    user, device_login = auth_deps._validate_refresh_token(db, refresh)
-    return auth_deps.generate_response(db, user, device_login)
+    return await auth_deps.refresh_session(db, refresh)
 
 
 @router.put("/me", status_code=200, response_model=UserInDB)
 async def update_curr_usr(
     *,
     request: Request,
+    response: Response,
     user: UserUpdate = Form(),
     image: UploadFile = File(None),
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
     payload: auth_deps.AuthData = Security(auth_deps.verify_token, scopes=[]),
 ):
-    usr = crud.user.get(db, id=payload.sub)
-    user = crud.user.update(db, db_obj=usr, obj_in=user)
-
-    if not user:
+    usr = await crud.user.aget(db, id=payload.sub)
+    if usr is None:
         raise HTTPException(status_code=404, detail="User not found.")
 
+    user = await crud.user.aupdate(db, db_obj=usr, obj_in=user)
+
     form = await request.form()
     if "image" in form:
-        user = await crud.user.update_image(db=db, db_obj=user, image=image)
+        timings: Dict[str, float] = {}
+        user = await crud.user.update_image(
+            db=db, db_obj=user, image=image, timings=timings
+        )
+        response.headers["Server-Timing"] = ", ".join(
+            f"{stage};dur={duration:.1f}" for stage, duration in timings.items()
+        )
     return user
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Response
+
+from app.api.auth_deps import signer
+from app.core.config import settings
+
+router = APIRouter()
+
+
+@router.get("/.well-known/jwks.json", tags=["auth"])
+def jwks(response: Response):
+    """Public keys that verify the tokens issued by this service"""
+    response.headers["Cache-Control"] = f"public, max-age={settings.JWKS_MAX_AGE}"
+    return signer.jwks
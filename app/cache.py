@@ -0,0 +1,137 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Generic, Hashable, List, Optional, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """Thread safe LRU cache whose entries expire after a TTL.
+
+    Once `max_entries` is reached the least recently used entry is evicted,
+    a cache with `max_entries=0` stores nothing.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, see `set`
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> Optional[V]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(
+        self,
+        key: K,
+        value: V,
+        *,
+        ttl: Optional[float] = None,
+        version: Optional[int] = None,
+    ) -> None:
+        """Store `value` for `ttl` seconds, defaults to the cache's TTL.
+
+        A value read from the source of truth may already be stale if an
+        invalidation happened while it was being read. Passing the `version`
+        observed before the read skips the store in that case.
+        """
+        if self.max_entries <= 0:
+            return
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: K) -> None:
+        with self._lock:
+            self.version += 1
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class Denylist(Generic[K]):
+    """Thread safe set of keys that each stay in it until they expire.
+
+    Unlike `TTLCache` nothing is ever evicted early, so it can hold
+    revocations: a key leaves only once its expiry has passed. Expired keys
+    are pruned, in expiry order, as new ones are added.
+    """
+
+    def __init__(self):
+        self._expires_at: Dict[K, float] = {}
+        # Heap of (expiry, key), an entry may be outdated by a later `add`
+        self._expiries: List[Tuple[float, K]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expires_at)
+
+    def __contains__(self, key: K) -> bool:
+        expires_at = self._expires_at.get(key)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def add(self, key: K, ttl: float) -> None:
+        """Deny `key` for the next `ttl` seconds"""
+        now = time.monotonic()
+        expires_at = now + ttl
+        with self._lock:
+            self._prune(now)
+            if ttl <= 0 or self._expires_at.get(key, now) >= expires_at:
+                return
+            self._expires_at[key] = expires_at
+            heapq.heappush(self._expiries, (expires_at, key))
+
+    def _prune(self, now: float) -> None:
+        while self._expiries and self._expiries[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiries)
+            if self._expires_at.get(key) == expires_at:
+                del self._expires_at[key]
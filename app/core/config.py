@@ -4,7 +4,7 @@ import pathlib
 from datetime import timedelta
 from pydantic import field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Union
 
 
 # Project Directories
@@ -20,6 +20,9 @@ class Settings(BaseSettings):
 
     API_V1_STR: str = "/api"
     STATIC_STR: str = "/static"
+    # Cache lifetimes, content addressed images never change
+    STATIC_IMMUTABLE_MAX_AGE: int = 365 * 24 * 60 * 60
+    STATIC_DEFAULT_MAX_AGE: int = 5 * 60
 
     HOST: str = "www.google.pt" if PRODUCTION else "http://localhost"
     STATIC_URL: str = HOST + STATIC_STR
@@ -43,9 +46,23 @@ class Settings(BaseSettings):
     POSTGRES_DB: str = "user_db"
     POSTGRES_URI: str = ""
     TEST_POSTGRES_URI: str = ""
+    ASYNC_POSTGRES_URI: str = ""
+    TEST_ASYNC_POSTGRES_URI: str = ""
 
     SCHEMA_NAME: str = "usr_microservice"
 
+    # Connection pool of each engine, per process
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    DB_POOL_RECYCLE: int = 30 * 60
+    DB_POOL_PRE_PING: bool = True
+    # Connect through PgBouncer in transaction mode, the pool settings above
+    # are then ignored. LISTEN needs a session of its own, so cache
+    # invalidations are received on POSTGRES_DIRECT_URI, which must bypass it.
+    DB_PGBOUNCER: bool = False
+    POSTGRES_DIRECT_URI: str = ""
+
     @model_validator(mode="after")
     def populate_database_uris(self) -> "Settings":
         if self.POSTGRES_URI == "":
@@ -62,6 +79,20 @@ class Settings(BaseSettings):
                 f":5432/{self.POSTGRES_DB}_test"
             )
 
+        if self.POSTGRES_DIRECT_URI == "":
+            self.POSTGRES_DIRECT_URI = self.POSTGRES_URI
+
+        # The async engine uses asyncpg, the sync one (alembic, tests) psycopg2
+        if self.ASYNC_POSTGRES_URI == "":
+            self.ASYNC_POSTGRES_URI = self.POSTGRES_URI.replace(
+                "postgresql://", "postgresql+asyncpg://", 1
+            )
+
+        if self.TEST_ASYNC_POSTGRES_URI == "":
+            self.TEST_ASYNC_POSTGRES_URI = self.TEST_POSTGRES_URI.replace(
+                "postgresql://", "postgresql+asyncpg://", 1
+            )
+
         return self
 
     # Auth
@@ -69,10 +100,37 @@ class Settings(BaseSettings):
     JWT_PUBLIC_KEY_PATH: str = "./dev-keys/jwt-key.pub"
     ACCESS_TOKEN_EXPIRE_MINUTES: timedelta = timedelta(hours=1)
     REFRESH_TOKEN_EXPIRE_MINUTES: timedelta = timedelta(days=7)
+    # Expired sessions are purged every interval (0 disables it) in batches,
+    # pausing between batches to keep locks short
+    SESSION_SWEEP_INTERVAL: float = 60 * 60
+    SESSION_SWEEP_BATCH_SIZE: int = 1000
+    SESSION_SWEEP_PAUSE: float = 0.1
+    # RS256, ES256 or EdDSA, the key pair must be of the matching type
     JWT_ALGORITHM: str = "RS256"
+    # Public keys accepted and published besides the current one. To rotate,
+    # add the next key here and wait JWKS_MAX_AGE, swap it in as the current
+    # key keeping the old public key here until its tokens have expired.
+    JWT_KEYRING_PATHS: List[str] = []
+    JWKS_MAX_AGE: int = 60 * 60
+    ACCESS_TOKEN_CACHE_MAX_ENTRIES: int = 10_000
     DEFAULT_USER_IMAGE: str = "/static/user/-1/default.jpg"
+    USER_BATCH_MAX_SIZE: int = 100
+    USER_PAGE_MAX_SIZE: int = 100
+    # In-process cache of user records
+    USER_CACHE_TTL: float = 60
+    USER_CACHE_MAX_ENTRIES: int = 10_000
+    # Image processing, 0 workers runs it in a thread instead of a process
+    IMAGE_POOL_WORKERS: int = 2
+    IMAGE_POOL_QUEUE_SIZE: int = 8
+    # Profile image variants, by name and the size of their bounding box
+    IMAGE_VARIANTS: Dict[str, int] = {"thumb": 64, "small": 256, "full": 1024}
+    IMAGE_WEBP: bool = True
     # Firebase
     FIREBASE_PROJECT_ID: str = "trailblazerauth"
+    FIREBASE_CERTS_URL: str = (
+        "https://www.googleapis.com/robot/v1/metadata/x509/"
+        "securetoken@system.gserviceaccount.com"
+    )
 
 
 settings = Settings()
@@ -0,0 +1,165 @@
+from base64 import urlsafe_b64encode
+from hashlib import sha256
+from typing import Any, Dict, Sequence, Tuple
+
+import jwt
+import orjson
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jwt.algorithms import get_default_algorithms
+
+# Algorithms the tokens issued by this service can be signed with
+ALGORITHMS = ("RS256", "ES256", "EdDSA")
+
+TokenError = jwt.PyJWTError
+
+
+# Members each key type's RFC 7638 thumbprint is computed over
+_THUMBPRINT_MEMBERS = {
+    "RSA": ("e", "kty", "n"),
+    "EC": ("crv", "kty", "x", "y"),
+    "OKP": ("crv", "kty", "x"),
+}
+
+
+def key_algorithm(public_key: Any) -> str:
+    """The algorithm of `ALGORITHMS` that `public_key` verifies"""
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return "RS256"
+    if isinstance(public_key, ec.EllipticCurvePublicKey) and isinstance(
+        public_key.curve, ec.SECP256R1
+    ):
+        return "ES256"
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return "EdDSA"
+    raise ValueError(f"Unsupported key type {type(public_key).__name__}")
+
+
+def public_jwk(algorithm: str, public_key: Any) -> Dict[str, str]:
+    """JWK of `public_key`, its `kid` is the key's RFC 7638 thumbprint"""
+    jwk = get_default_algorithms()[algorithm].to_jwk(public_key, as_dict=True)
+    members = {name: jwk[name] for name in _THUMBPRINT_MEMBERS[jwk["kty"]]}
+    thumbprint = sha256(orjson.dumps(members, option=orjson.OPT_SORT_KEYS)).digest()
+    kid = urlsafe_b64encode(thumbprint).rstrip(b"=").decode()
+    return {**members, "kid": kid, "alg": algorithm, "use": "sig"}
+
+
+class TokenSigner:
+    """Signs and verifies JWTs with keys that are parsed only once.
+
+    Loading a PEM key costs more than a signature (cryptography validates the
+    whole RSA key on every load), so the parsed key objects are kept instead
+    of the PEM text.
+
+    Tokens carry the `kid` of the key that signed them. Besides the current
+    key, `keyring` holds public keys that are still accepted and published:
+    the previous keys until the tokens they signed expire, and the next key
+    so consumers have it cached before it starts signing.
+    """
+
+    def __init__(
+        self,
+        algorithm: str,
+        private_key: bytes,
+        public_key: bytes,
+        keyring: Sequence[bytes] = (),
+    ):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(
+                f'Unsupported JWT algorithm "{algorithm}", use one of {ALGORITHMS}'
+            )
+
+        self.algorithm = algorithm
+        implementation = get_default_algorithms()[algorithm]
+        self.private_key = implementation.prepare_key(private_key)
+        self.public_key = implementation.prepare_key(public_key)
+
+        jwks = [public_jwk(algorithm, self.public_key)]
+        self.kid = jwks[0]["kid"]
+        self._keys: Dict[str, Tuple[str, Any]] = {
+            self.kid: (algorithm, self.public_key)
+        }
+        for pem in keyring:
+            key = serialization.load_pem_public_key(pem)
+            key_alg = key_algorithm(key)
+            jwk = public_jwk(key_alg, key)
+            if jwk["kid"] not in self._keys:
+                self._keys[jwk["kid"]] = (key_alg, key)
+                jwks.append(jwk)
+        self.jwks = {"keys": jwks}
+
+        # Fail at startup rather than on the first login if the keys don't
+        # match each other or the algorithm
+        try:
+            self.verify(self.sign({}))
+        except (TokenError, TypeError, ValueError) as e:
+            raise ValueError(f"Keys can't be used with {algorithm}: {e}") from e
+
+    @classmethod
+    def from_files(
+        cls,
+        algorithm: str,
+        private_key_path: str,
+        public_key_path: str,
+        keyring_paths: Sequence[str] = (),
+    ) -> "TokenSigner":
+        with open(private_key_path, "rb") as f:
+            private_key = f.read()
+        with open(public_key_path, "rb") as f:
+            public_key = f.read()
+        keyring = []
+        for path in keyring_paths:
+            with open(path, "rb") as f:
+                keyring.append(f.read())
+        return cls(algorithm, private_key, public_key, keyring)
+
+    def sign(self, payload: Dict[str, Any]) -> str:
+        return jwt.encode(
+            payload,
+            self.private_key,
+            algorithm=self.algorithm,
+            headers={"kid": self.kid},
+        )
+
+    def verify(self, token: str, require: Sequence[str] = ()) -> Dict[str, Any]:
+        """Decode `token`, raises `TokenError` if it isn't valid"""
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            # Issued before tokens carried a key id, by the current key
+            algorithm, key = self.algorithm, self.public_key
+        elif kid in self._keys:
+            algorithm, key = self._keys[kid]
+        else:
+            raise jwt.InvalidKeyError(f'Unknown key id "{kid}"')
+
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            options={"require": list(require)},
+        )
+
+
+def generate_keys(algorithm: str) -> Tuple[bytes, bytes]:
+    """New (private, public) PEM key pair for `algorithm`"""
+    if algorithm == "RS256":
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == "ES256":
+        key = ec.generate_private_key(ec.SECP256R1())
+    else:
+        key = ed25519.Ed25519PrivateKey.generate()
+
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return private_pem, public_pem
+
+
+def unverified_claims(token: str) -> Dict[str, Any]:
+    """Claims of `token` without checking its signature"""
+    return jwt.decode(token, options={"verify_signature": False})
@@ -1 +1,2 @@
 from .crud_user import user
+from .crud_device_login import device_login
@@ -1,3 +1,5 @@
+import orjson
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from loguru import logger
 from itertools import starmap
 from typing import (
@@ -17,12 +19,20 @@ from fastapi import HTTPException
 from pydantic import BaseModel
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import select, delete, update
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, any_, literal, or_, select, delete, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy.sql import ColumnCollection, ColumnElement
-from psycopg2.errors import ForeignKeyViolation, UniqueViolation
+from sqlalchemy.sql import ColumnCollection, ColumnElement, visitors
+from sqlalchemy.sql.schema import Column
+from psycopg2.errorcodes import FOREIGN_KEY_VIOLATION, UNIQUE_VIOLATION
 
 from app.db.base_class import Base
+from app.cache import TTLCache
+from app.db.notify import notify_stmt, register_cache
+from app.metrics import cache_collector
 
 _PrimaryKeyType = Union[Any, Tuple[Any, ...]]
 
@@ -35,26 +45,63 @@ class BadSelectorKey(Exception):
     pass
 
 
+class BadCursor(ValueError):
+    pass
+
+
+class UnknownField(ValueError):
+    pass
+
+
+def encode_cursor(id: _PrimaryKeyType) -> str:
+    values = list(id) if isinstance(id, tuple) else [id]
+    return urlsafe_b64encode(orjson.dumps(values)).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str, columns: ColumnCollection) -> _PrimaryKeyType:
+    """The primary key encoded in `cursor`, checked against `columns`.
+
+    A cursor comes from the client, anything that isn't one value of the
+    right type per column is rejected before it reaches the database.
+    """
+    try:
+        values = orjson.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadCursor(f'Invalid cursor "{cursor}"')
+
+    cols = columns.values()
+    if not isinstance(values, list) or len(values) != len(cols):
+        raise BadCursor(f'Invalid cursor "{cursor}"')
+    for col, value in zip(cols, values):
+        python_type = col.type.python_type
+        # JSON booleans would pass for integers
+        if not isinstance(value, python_type) or (
+            isinstance(value, bool) and python_type is not bool
+        ):
+            raise BadCursor(f'Invalid cursor "{cursor}"')
+        # Postgres doesn't accept NUL in text
+        if isinstance(value, str) and "\x00" in value:
+            raise BadCursor(f'Invalid cursor "{cursor}"')
+    return values[0] if len(values) == 1 else tuple(values)
+
+
 def _primary_key(
     model_name: str, id: _PrimaryKeyType, columns: ColumnCollection
 ) -> Sequence[ColumnElement]:
     cols_values = columns.values()
-    if isinstance(id, Iterable):
-        id_iter = iter(id)
-        col_iter = iter(cols_values)
-
-        selector = list(
-            starmap(lambda col, id_sel: col == id_sel, zip(col_iter, id_iter))
-        )
-
-        if next(col_iter, None) is not None or next(id_iter, None) is not None:
+    # Strings are iterable but always a single column's value
+    if isinstance(id, Iterable) and not isinstance(id, (str, bytes)):
+        id_values = tuple(id)
+        if len(id_values) != len(cols_values):
             raise BadSelectorKey(
                 "Mismatch in the length of the selector"
                 " "
                 f'and the primary key columns for "{model_name}"'
             )
 
-        return selector
+        return list(
+            starmap(lambda col, id_sel: col == id_sel, zip(cols_values, id_values))
+        )
     else:
         if len(columns) != 1:
             raise BadSelectorKey(
@@ -70,24 +117,98 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     _foreign_key_checks = {}
     _unique_violation_msg = "Already exists"
 
-    def __init__(self, model: Type[ModelType]):
+    def __init__(self, model: Type[ModelType], cache: Optional[TTLCache] = None):
         """
         CRUD object with default methods to Create, Read, Update, Delete (CRUD).
         **Parameters**
         * `model`: A SQLAlchemy model class
-        * `schema`: A Pydantic model (schema) class
+        * `cache`: Optional cache of records by primary key, entries are
+          invalidated by every write made through this object
         """
         self.model = model
         self.primary_key = self.model.__table__.primary_key.columns
+        self.cache = cache
+        if cache is not None:
+            register_cache(self.model.__tablename__, cache)
+            cache_collector.register(self.model.__tablename__, cache)
+
+        mapper = inspect(self.model)
+        self._primary_key_attrs = [
+            mapper.get_property_by_column(col).key for col in mapper.primary_key
+        ]
+        self._column_attrs = [attr.key for attr in mapper.column_attrs]
+        # Columns labelled by attribute name, to read records without the ORM
+        self._record_columns = {
+            attr.key: attr.columns[0].label(attr.key) for attr in mapper.column_attrs
+        }
+        # Names of the columns with an index other than the primary key's
+        self._indexed_columns = {
+            col.name for index in self.model.__table__.indexes for col in index.columns
+        }
+
+    def _identity(self, db_obj: ModelType) -> _PrimaryKeyType:
+        # Persistent objects know their key even once expired, reading the
+        # attributes would load them again
+        values = inspect(db_obj).identity or tuple(
+            getattr(db_obj, key) for key in self._primary_key_attrs
+        )
+        return values[0] if len(values) == 1 else values
+
+    @staticmethod
+    def _cache_key(id: _PrimaryKeyType) -> Any:
+        return tuple(id) if isinstance(id, list) else id
+
+    def _invalidate(self, id: _PrimaryKeyType) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(self._cache_key(id))
+
+    def _notify(self, db: Session, id: _PrimaryKeyType) -> None:
+        """Tell the other workers to drop `id` from their caches on commit"""
+        if self.cache is not None:
+            db.execute(notify_stmt(self.model.__tablename__, self._cache_key(id)))
+
+    async def _anotify(self, db: AsyncSession, id: _PrimaryKeyType) -> None:
+        if self.cache is not None:
+            await db.execute(notify_stmt(self.model.__tablename__, self._cache_key(id)))
+
+    def _invalidate_on_commit(
+        self, db: Union[Session, AsyncSession], id: _PrimaryKeyType
+    ) -> None:
+        # Readers could cache the old record again until the transaction
+        # commits, so invalidate both now and once it's committed.
+        if self.cache is not None:
+            self._invalidate(id)
+            session = db.sync_session if isinstance(db, AsyncSession) else db
+            event.listen(
+                session, "after_commit", lambda _: self._invalidate(id), once=True
+            )
+
+    def to_record(self, db_obj: ModelType) -> Dict[str, Any]:
+        """Plain dict of the object's columns, keyed by attribute name"""
+        record = {}
+        for key in self._column_attrs:
+            value = getattr(db_obj, key)
+            record[key] = list(value) if isinstance(value, list) else value
+        return record
 
     def _integrity_error_handler(self, e: IntegrityError):
-        if isinstance(e.orig, ForeignKeyViolation):
-            msg = self._foreign_key_checks.get(e.orig.diag.constraint_name, None)
+        # psycopg2 exposes the error details through `pgcode` and `diag` while
+        # the asyncpg adapter has `sqlstate` and keeps the original exception
+        # as the cause.
+        sqlstate = getattr(e.orig, "pgcode", None) or getattr(e.orig, "sqlstate", None)
+        if sqlstate == FOREIGN_KEY_VIOLATION:
+            diag = getattr(e.orig, "diag", None)
+            if diag is not None:
+                constraint_name = diag.constraint_name
+            else:
+                constraint_name = getattr(e.orig.__cause__, "constraint_name", None)
+
+            msg = self._foreign_key_checks.get(constraint_name, None)
             if msg is not None:
                 raise HTTPException(status_code=400, detail=msg)
             else:
                 logger.error("Unhandled foreign key violation")
-        elif isinstance(e.orig, UniqueViolation):
+        elif sqlstate == UNIQUE_VIOLATION:
             raise HTTPException(status_code=409, detail=self._unique_violation_msg)
 
     def get(
@@ -95,52 +216,318 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     ) -> Optional[ModelType]:
         return db.get(self.model, id, with_for_update=for_update)
 
+    async def aget(
+        self, db: AsyncSession, id: _PrimaryKeyType, for_update: bool = False
+    ) -> Optional[ModelType]:
+        return await db.get(self.model, id, with_for_update=for_update)
+
+    def projection(self, fields: Iterable[str]) -> Tuple[str, ...]:
+        """Check that `fields` are column attributes, returns them deduplicated"""
+        projection = tuple(dict.fromkeys(fields))
+        for field in projection:
+            if field not in self._record_columns:
+                raise UnknownField(f'Unknown field "{field}"')
+        return projection
+
+    def _get_record_stmt(
+        self, id: _PrimaryKeyType, fields: Optional[Sequence[str]] = None
+    ):
+        if fields is None:
+            columns = self._record_columns.values()
+        else:
+            columns = [self._record_columns[field] for field in fields]
+        return select(*columns).where(
+            *_primary_key(self.model.__name__, id, self.primary_key)
+        )
+
+    async def _aselect_record(
+        self,
+        db: AsyncSession,
+        id: _PrimaryKeyType,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        row = (await db.execute(self._get_record_stmt(id, fields))).mappings().first()
+        return None if row is None else dict(row)
+
+    async def aget_record(
+        self,
+        db: AsyncSession,
+        id: _PrimaryKeyType,
+        fields: Optional[Sequence[str]] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Same as `aget` but returns the record as a dict, through the cache.
+
+        The columns are selected as a plain row, no ORM object is built and
+        the session's identity map is left alone. With `fields`, a projection
+        checked by `projection`, only those columns are read and returned.
+        """
+        if self.cache is None:
+            return await self._aselect_record(db, id, fields)
+
+        key = self._cache_key(id)
+        record = self.cache.get(key)
+        if record is not None:
+            if fields is None:
+                return record
+            return {field: record[field] for field in fields}
+
+        if fields is not None:
+            # Partial records aren't cached, the next full read will be
+            return await self._aselect_record(db, id, fields)
+
+        version = self.cache.version
+        record = await self._aselect_record(db, id)
+        if record is None:
+            return None
+
+        self.cache.set(key, record, version=version)
+        return record
+
+    def _get_many_stmt(self, ids: Sequence[_PrimaryKeyType]):
+        if len(self.primary_key) == 1:
+            col = self.primary_key.values()[0]
+            return select(self.model).where(
+                col == any_(literal(list(ids), ARRAY(col.type)))
+            )
+
+        selectors = (
+            and_(*_primary_key(self.model.__name__, id, self.primary_key)) for id in ids
+        )
+        return select(self.model).where(or_(*selectors))
+
+    def get_many(
+        self, db: Session, ids: Sequence[_PrimaryKeyType]
+    ) -> Sequence[ModelType]:
+        """Fetch every object whose primary key is in `ids` in a single query.
+
+        Ids without a matching object are skipped and the order of the
+        results is unspecified.
+        """
+        if len(ids) == 0:
+            return []
+        return db.scalars(self._get_many_stmt(ids)).all()
+
+    async def aget_many(
+        self, db: AsyncSession, ids: Sequence[_PrimaryKeyType]
+    ) -> Sequence[ModelType]:
+        if len(ids) == 0:
+            return []
+        return (await db.scalars(self._get_many_stmt(ids))).all()
+
+    def _uses_index(self, filters: Sequence[ColumnElement]) -> bool:
+        """Whether any of `filters` is on an indexed column"""
+        return any(
+            isinstance(element, Column)
+            and element.table is self.model.__table__
+            and element.name in self._indexed_columns
+            for condition in filters
+            for element in visitors.iterate(condition)
+        )
+
+    def _get_multi_stmt(
+        self,
+        after: Optional[_PrimaryKeyType],
+        limit: Optional[int],
+        filters: Sequence[ColumnElement],
+        for_update: bool,
+    ):
+        cols = self.primary_key.values()
+        conditions = list(filters)
+        if after is not None:
+            if len(cols) == 1:
+                conditions.append(cols[0] > after)
+            else:
+                conditions.append(tuple_(*cols) > tuple_(*after))
+
+        if not self._uses_index(filters):
+            stmt = select(self.model).where(*conditions).order_by(*cols).limit(limit)
+        else:
+            # With ORDER BY ... LIMIT the planner prefers walking the primary
+            # key index and filtering rows as they come, which reads the
+            # whole table when few rows match. The keys of the matches are
+            # collected first instead, through the indexes of the filters,
+            # and only the rows of the page are loaded.
+            matches = (
+                select(*cols)
+                .where(*conditions)
+                .cte("matches")
+                .prefix_with("MATERIALIZED")
+            )
+            page = select(*matches.c).order_by(*matches.c).limit(limit)
+            key = cols[0] if len(cols) == 1 else tuple_(*cols)
+            stmt = select(self.model).where(key.in_(page)).order_by(*cols)
+        if for_update:
+            stmt = stmt.with_for_update()
+
+        return stmt
+
     def get_multi(
         self,
         db: Session,
         *,
-        skip: Optional[int] = None,
+        after: Optional[_PrimaryKeyType] = None,
         limit: Optional[int] = None,
+        filters: Sequence[ColumnElement] = (),
         for_update: bool = False,
     ) -> Sequence[ModelType]:
-        stmt = select(self.model).limit(limit).offset(skip)
-        if for_update:
-            stmt = stmt.with_for_update()
+        """Page through the objects in primary key order.
+
+        Keyset pagination: `after` is the primary key of the last object of
+        the previous page, so every page costs the same index scan no matter
+        how deep it is.
+        """
+        stmt = self._get_multi_stmt(after, limit, filters, for_update)
+        return db.scalars(stmt).all()
+
+    async def aget_multi(
+        self,
+        db: AsyncSession,
+        *,
+        after: Optional[_PrimaryKeyType] = None,
+        limit: Optional[int] = None,
+        filters: Sequence[ColumnElement] = (),
+        for_update: bool = False,
+    ) -> Sequence[ModelType]:
+        stmt = self._get_multi_stmt(after, limit, filters, for_update)
+        return (await db.scalars(stmt)).all()
+
+    def cursor(self, db_obj: ModelType) -> str:
+        """Opaque token to fetch the objects that come after `db_obj`"""
+        return encode_cursor(self._identity(db_obj))
 
-        return db.execute(stmt).scalars(stmt).all()
+    def decode_cursor(self, cursor: str) -> _PrimaryKeyType:
+        """The `after` of a token from `cursor`, raises `BadCursor` if it
+        isn't one"""
+        return decode_cursor(cursor, self.primary_key)
 
     def create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType:
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in_data)
         try:
             db.add(db_obj)
+            self._notify(db, self._identity(db_obj))
             db.commit()
+            self._invalidate(self._identity(db_obj))
             db.refresh(db_obj)
             return db_obj
         except IntegrityError as e:
             self._integrity_error_handler(e)
             raise e
 
-    def update(
+    async def acreate(self, db: AsyncSession, *, obj_in: CreateSchemaType) -> ModelType:
+        obj_in_data = jsonable_encoder(obj_in)
+        db_obj = self.model(**obj_in_data)
+        try:
+            db.add(db_obj)
+            await self._anotify(db, self._identity(db_obj))
+            await db.commit()
+            self._invalidate(self._identity(db_obj))
+            await db.refresh(db_obj)
+            return db_obj
+        except IntegrityError as e:
+            self._integrity_error_handler(e)
+            raise e
+
+    async def acreate_if_absent(
+        self, db: AsyncSession, *, obj_in: CreateSchemaType
+    ) -> Optional[ModelType]:
+        """Insert the object unless its primary key is taken, None if it is.
+
+        A single INSERT ... ON CONFLICT DO NOTHING RETURNING, so concurrent
+        creations of the same key can't both succeed. Nothing is committed,
+        whatever the caller writes next can go in the same transaction.
+        Other unique violations are still reported as errors.
+        """
+        stmt = (
+            pg_insert(self.model)
+            .values(obj_in.model_dump())
+            .on_conflict_do_nothing(index_elements=list(self.primary_key))
+            .returning(self.model)
+        )
+        try:
+            # Absent records are never cached, there is nothing to invalidate
+            return (await db.execute(stmt)).scalar_one_or_none()
+        except IntegrityError as e:
+            self._integrity_error_handler(e)
+            raise e
+
+    def _update_stmt(
         self,
-        db: Session,
-        *,
         db_obj: ModelType,
         obj_in: Union[UpdateSchemaType, Dict[str, Any]],
-    ) -> ModelType:
-        obj_data = jsonable_encoder(db_obj)
+    ):
+        """UPDATE ... RETURNING of the columns `obj_in` changes, None if it
+        changes nothing. Values are compared with those loaded in `db_obj`."""
         if isinstance(obj_in, dict):
             update_data = obj_in
         else:
             update_data = obj_in.model_dump(exclude_unset=True)
-        for field in obj_data:
-            if field in update_data:
-                setattr(db_obj, field, update_data[field])
 
+        loaded = inspect(db_obj).dict
+        changes = {
+            field: value
+            for field, value in update_data.items()
+            if field in self._record_columns
+            and (field not in loaded or loaded[field] != value)
+        }
+        if not changes:
+            return None
+        return (
+            update(self.model)
+            .where(
+                *_primary_key(
+                    self.model.__name__, self._identity(db_obj), self.primary_key
+                )
+            )
+            .values(changes)
+            .returning(self.model)
+        )
+
+    def update(
+        self,
+        db: Session,
+        *,
+        db_obj: ModelType,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]],
+    ) -> ModelType:
+        stmt = self._update_stmt(db_obj, obj_in)
+        if stmt is None:
+            return db_obj
+
+        id = self._identity(db_obj)
         try:
-            db.add(db_obj)
+            # The returned row refreshes `db_obj` in the identity map
+            db.execute(stmt)
+            values = {key: getattr(db_obj, key) for key in self._column_attrs}
+            self._notify(db, id)
             db.commit()
-            db.refresh(db_obj)
+            self._invalidate(id)
+            # The commit expires `db_obj` in a session with `expire_on_commit`,
+            # the row is put back so that reading it doesn't SELECT it again
+            for key, value in values.items():
+                set_committed_value(db_obj, key, value)
+            return db_obj
+        except IntegrityError as e:
+            self._integrity_error_handler(e)
+            raise e
+
+    async def aupdate(
+        self,
+        db: AsyncSession,
+        *,
+        db_obj: ModelType,
+        obj_in: Union[UpdateSchemaType, Dict[str, Any]],
+    ) -> ModelType:
+        stmt = self._update_stmt(db_obj, obj_in)
+        if stmt is None:
+            return db_obj
+
+        id = self._identity(db_obj)
+        try:
+            await db.execute(stmt)
+            await self._anotify(db, id)
+            await db.commit()
+            self._invalidate(id)
             return db_obj
         except IntegrityError as e:
             self._integrity_error_handler(e)
@@ -161,19 +548,67 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
 
         stmt = stmt.where(*_primary_key(self.model.__name__, id, self.primary_key))
 
+        self._invalidate_on_commit(db, id)
+        try:
+            db_obj = db.execute(stmt).scalar_one_or_none()
+        except IntegrityError as e:
+            self._integrity_error_handler(e)
+            raise e
+
+        if db_obj is not None and len(update_data) != 0:
+            self._notify(db, id)
+        return db_obj
+
+    async def aupdate_locked(
+        self,
+        db: AsyncSession,
+        *,
+        id: _PrimaryKeyType,
+        obj_in: UpdateSchemaType,
+    ) -> Optional[ModelType]:
+        update_data = obj_in.model_dump(exclude_unset=True)
+        if len(update_data) != 0:
+            stmt = update(self.model).values(update_data).returning(self.model)
+        else:
+            stmt = select(self.model)
+
+        stmt = stmt.where(*_primary_key(self.model.__name__, id, self.primary_key))
+
+        self._invalidate_on_commit(db, id)
         try:
-            return db.execute(stmt).scalar_one_or_none()
+            db_obj = (await db.execute(stmt)).scalar_one_or_none()
         except IntegrityError as e:
             self._integrity_error_handler(e)
             raise e
 
+        if db_obj is not None and len(update_data) != 0:
+            await self._anotify(db, id)
+        return db_obj
+
     def delete(self, db: Session, *, id: _PrimaryKeyType) -> Optional[ModelType]:
         stmt = (
             delete(self.model)
             .where(*_primary_key(self.model.__name__, id, self.primary_key))
             .returning(self.model)
         )
+        self._invalidate_on_commit(db, id)
         res = db.execute(stmt).one_or_none()
         if res is None:
             return None
+        self._notify(db, id)
+        return res[0]
+
+    async def adelete(
+        self, db: AsyncSession, *, id: _PrimaryKeyType
+    ) -> Optional[ModelType]:
+        stmt = (
+            delete(self.model)
+            .where(*_primary_key(self.model.__name__, id, self.primary_key))
+            .returning(self.model)
+        )
+        self._invalidate_on_commit(db, id)
+        res = (await db.execute(stmt)).one_or_none()
+        if res is None:
+            return None
+        await self._anotify(db, id)
         return res[0]
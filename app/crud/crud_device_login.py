@@ -0,0 +1,48 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.base import CRUDBase
+from app.models.device_login import DeviceLogin
+from app.models.user import User
+
+
+class CRUDDeviceLogin(CRUDBase[DeviceLogin, BaseModel, BaseModel]):
+    async def arotate(
+        self,
+        db: AsyncSession,
+        *,
+        user_id: str,
+        session_id: int,
+        issued_at: datetime,
+        refreshed_at: datetime,
+        expires_at: datetime,
+    ) -> Optional[User]:
+        """Move a session on to a new refresh token and load its user.
+
+        Validation, rotation and the user lookup are a single statement. The
+        session is only updated if it hasn't expired yet and the token being
+        exchanged, issued at `issued_at`, is not older than the last one
+        handed out (tokens have a precision of one second). Returns `None`
+        when any of this doesn't hold, or when the session doesn't exist.
+        """
+        rotated = (
+            update(DeviceLogin)
+            .where(
+                DeviceLogin.user_id == user_id,
+                DeviceLogin.session_id == session_id,
+                DeviceLogin.expires_at >= refreshed_at,
+                func.date_trunc("second", DeviceLogin.refreshed_at) <= issued_at,
+            )
+            .values(refreshed_at=refreshed_at, expires_at=expires_at)
+            .returning(DeviceLogin.user_id)
+            .cte("rotated")
+        )
+        stmt = select(User).join(rotated, User.uid == rotated.c.user_id)
+        return (await db.scalars(stmt)).one_or_none()
+
+
+device_login = CRUDDeviceLogin(DeviceLogin)
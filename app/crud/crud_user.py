@@ -1,72 +1,97 @@
-import os
-from sqlalchemy.orm import Session
+import time
+from typing import Dict, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import ColumnElement
+from app.cache import TTLCache
+from app.core.config import settings
 from app.crud.base import CRUDBase
 from app.models.user import User
-from app.schemas.user import UserCreate, UserUpdate
+from app.schemas.user import MatchEnum, UserCreate, UserUpdate
 from fastapi import UploadFile
-from io import BytesIO
 from app.exception import FileFormatException
+from app.metrics import timed
+from app.images import (
+    ImageFormatError,
+    image_pool,
+    process_profile_image,
+    remove_profile_image,
+)
 from starlette.datastructures import UploadFile as StarletteUploadFile
 from hashlib import md5
-from PIL import Image, ImageOps
 from loguru import logger
 
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
-
-    def update(
-        self,
-        db: Session,
+    @staticmethod
+    def filters(
         *,
-        db_obj: User,
-        obj_in: UserUpdate,
-    ) -> User:
-        if isinstance(obj_in, dict):
-            update_data = obj_in
-        else:
-            update_data = obj_in.dict(exclude_unset=True)
-        return super(CRUDUser, self).update(db, db_obj=db_obj, obj_in=update_data)
+        roles: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        verified: Optional[bool] = None,
+        match: MatchEnum = MatchEnum.ALL,
+    ) -> List[ColumnElement]:
+        """Conditions matching users that have every (or, with `match=any`,
+        at least one) role and tag given.
+
+        Both `@>` and `&&` are served by the GIN indexes on the arrays.
+        """
+
+        def matches(col, values):
+            if match == MatchEnum.ANY:
+                return col.overlap(values)
+            return col.contains(values)
 
+        filters = []
+        if roles:
+            filters.append(matches(User.roles, roles))
+        if tags:
+            filters.append(matches(User.tags, tags))
+        if verified is not None:
+            filters.append(User.verified == verified)
+        return filters
+
+    @timed("update_image")
     async def update_image(
         self,
-        db: Session,
+        db: AsyncSession,
         *,
         db_obj: User,
         image: UploadFile | bytes | None,
+        timings: Optional[Dict[str, float]] = None,
     ) -> User:
+        """Store a new profile image for the user.
+
+        Decoding and encoding run in the image pool, if `timings` is given it's
+        filled with the duration of each stage in milliseconds.
+        """
         img_path = None
         delete_old = image is None
 
         if image is not None:
-            try:
-                if isinstance(image, StarletteUploadFile):
-                    image = await image.read()
-                img_bytes = BytesIO(image)
-                md5sum = md5(img_bytes.getbuffer())
-                img = Image.open(img_bytes)
-            except:
-                raise FileFormatException()
-            ext = img.format
-            if ext not in ("JPEG", "PNG", "BMP"):
-                raise FileFormatException(detail="Image format must be JPEG or PNG.")
+            if isinstance(image, StarletteUploadFile):
+                image = await image.read()
+            md5sum = md5(image)
 
-            img = ImageOps.exif_transpose(img)
-            img = img.convert("RGB")
-            os.makedirs(f"static/user/users/{db_obj.uid}", exist_ok=True)
             img_path = f"/user/users/{db_obj.uid}/{md5sum.hexdigest()}.jpg"
-            img.save(
-                f"static{img_path}",
-                format="JPEG",
-                quality="web_high",
-                optimize=True,
-                progressive=True,
-            )
+            start = time.perf_counter()
+            try:
+                stages = await image_pool.run(
+                    process_profile_image, image, f"static{img_path}"
+                )
+            except ImageFormatError as e:
+                raise FileFormatException(detail=str(e))
+
+            if timings is not None:
+                total = (time.perf_counter() - start) * 1000
+                timings["queue"] = total - sum(stages.values())
+                timings.update(stages)
+            logger.debug(f"Processed profile picture for user {db_obj.uid}: {stages}")
 
-            delete_old = img_path != db_obj.image
+            delete_old = f"/static{img_path}" != db_obj.image
 
             if delete_old:
                 try:
-                    os.remove(f"static{db_obj.image}")
+                    remove_profile_image(db_obj.image)
                 except Exception as e:
                     logger.error(
                         f"Failed to delete profile picture for user {db_obj.uid}: {e}"
@@ -74,8 +99,13 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
 
             setattr(db_obj, "image", f"/static{img_path}")
             db.add(db_obj)
-            db.commit()
+            await self._anotify(db, db_obj.uid)
+            await db.commit()
+            self._invalidate(db_obj.uid)
             return db_obj
 
 
-user = CRUDUser(User)
+user = CRUDUser(
+    User,
+    cache=TTLCache(settings.USER_CACHE_MAX_ENTRIES, settings.USER_CACHE_TTL),
+)
@@ -5,7 +5,7 @@ from .session import engine
 from app.utils import ROOT_DIR
 from app.core.config import settings
 
-last_known_revision = "e63d7af6ac9f"
+last_known_revision = "9132d716c92f"
 
 def init_db() -> None:
     if not settings.PRODUCTION:
@@ -0,0 +1,133 @@
+"""Cross process cache invalidation through Postgres LISTEN/NOTIFY.
+
+Writes made through the CRUD objects emit a notification on the schema's
+channel inside their transaction, so it is only delivered once they commit.
+Every worker runs an `InvalidationListener` that fans these out to the
+caches registered for the table.
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import Any, DefaultDict, List, Optional
+
+import asyncpg
+import orjson
+from loguru import logger
+from sqlalchemy import func, select
+
+from app.cache import TTLCache
+from app.core.config import settings
+
+CHANNEL = settings.SCHEMA_NAME
+APPLICATION_NAME = "cache-invalidation-listener"
+
+_caches: DefaultDict[str, List[TTLCache]] = defaultdict(list)
+
+
+def register_cache(table: str, cache: TTLCache) -> None:
+    """Invalidate `cache` whenever a row of `table` changes."""
+    _caches[table].append(cache)
+
+
+def notify_payload(table: str, key: Any) -> str:
+    return orjson.dumps({"table": table, "key": key}).decode()
+
+
+def notify_stmt(table: str, key: Any):
+    return select(func.pg_notify(CHANNEL, notify_payload(table, key)))
+
+
+def invalidate(table: str, key: Any) -> None:
+    # JSON turns composite keys into lists
+    if isinstance(key, list):
+        key = tuple(key)
+    for cache in _caches.get(table, ()):
+        cache.invalidate(key)
+
+
+def flush_all() -> None:
+    for caches in _caches.values():
+        for cache in caches:
+            cache.clear()
+
+
+class InvalidationListener:
+    """Background task that LISTENs on the schema's channel.
+
+    The connection is checked every `keepalive` seconds and re-established
+    with exponential backoff if lost. Notifications sent while disconnected
+    are gone, so every (re)connection flushes all the local caches.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        *,
+        keepalive: float = 30,
+        min_backoff: float = 1,
+        max_backoff: float = 30,
+    ):
+        self.dsn = dsn
+        self.keepalive = keepalive
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._task: Optional[asyncio.Task] = None
+        self.connected = asyncio.Event()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _on_notification(self, conn, pid, channel, payload: str) -> None:
+        try:
+            message = orjson.loads(payload)
+            invalidate(message["table"], message["key"])
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            logger.error(f"Malformed invalidation notification: {payload}")
+            flush_all()
+
+    async def _listen(self) -> None:
+        conn = await asyncpg.connect(
+            self.dsn, server_settings={"application_name": APPLICATION_NAME}
+        )
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda _: closed.set())
+        try:
+            await conn.add_listener(CHANNEL, self._on_notification)
+            flush_all()
+            self.connected.set()
+            logger.info(f'Listening for cache invalidations on "{CHANNEL}"')
+
+            while not closed.is_set():
+                try:
+                    await asyncio.wait_for(closed.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    await conn.execute("SELECT 1", timeout=self.keepalive)
+        finally:
+            self.connected.clear()
+            await conn.close(timeout=1)
+
+    async def _run(self) -> None:
+        backoff = self.min_backoff
+        while True:
+            try:
+                await self._listen()
+                backoff = self.min_backoff
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener failed: {e}")
+
+            # Anything cached from now on may miss notifications
+            flush_all()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
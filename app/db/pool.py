@@ -0,0 +1,82 @@
+"""Connection pools that report their usage to Prometheus.
+
+Gauges are read from the pools at scrape time, the time spent waiting for a
+connection is recorded on every checkout. Pools are labelled by their
+`logging_name`.
+"""
+
+import time
+from typing import Any, Dict, List
+
+from prometheus_client import REGISTRY, Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent getting a connection from the pool",
+    ["pool"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts",
+    "Checkouts that gave up waiting for a connection",
+    ["pool"],
+)
+
+
+class _TimedCheckout:
+    def _do_get(self) -> Any:
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            POOL_TIMEOUTS.labels(self.logging_name).inc()
+            raise
+        finally:
+            POOL_WAIT.labels(self.logging_name).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+class PoolCollector(Collector):
+    def __init__(self) -> None:
+        self._engines: List[Engine] = []
+
+    def register(self, engine: Engine) -> None:
+        self._engines.append(engine)
+
+    def collect(self):
+        gauges: Dict[str, GaugeMetricFamily] = {
+            name: GaugeMetricFamily(f"db_pool_{name}", doc, labels=["pool"])
+            for name, doc in (
+                ("size", "Connections the pool keeps open"),
+                ("checked_out", "Connections in use"),
+                ("overflow", "Connections open beyond the pool size"),
+            )
+        }
+        for engine in self._engines:
+            # Only queue pools keep connections, e.g. not the NullPool used
+            # behind PgBouncer
+            pool = engine.pool
+            if not isinstance(pool, QueuePool):
+                continue
+            label = [pool.logging_name]
+            gauges["size"].add_metric(label, pool.size())
+            gauges["checked_out"].add_metric(label, pool.checkedout())
+            gauges["overflow"].add_metric(label, max(pool.overflow(), 0))
+
+        yield from gauges.values()
+
+
+pool_collector = PoolCollector()
+REGISTRY.register(pool_collector)
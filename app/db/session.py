@@ -1,8 +1,54 @@
+from typing import Any, Dict
+from uuid import uuid4
+
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 from app.core.config import settings
+from app.metrics import observe_statements
+from app.db.pool import TimedAsyncAdaptedQueuePool, TimedQueuePool, pool_collector
+
+
+def _pool_options(name: str, asynchronous: bool) -> Dict[str, Any]:
+    if settings.DB_PGBOUNCER:
+        # PgBouncer does the pooling, and in transaction mode consecutive
+        # transactions may run on different server connections, so asyncpg
+        # must neither cache prepared statements nor reuse their names.
+        options: Dict[str, Any] = {"poolclass": NullPool}
+        if asynchronous:
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+            }
+        return options
 
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if asynchronous else TimedQueuePool,
+        "pool_logging_name": name,
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
 
-engine = create_engine(settings.POSTGRES_URI)
+
+engine = create_engine(settings.POSTGRES_URI, **_pool_options("sync", False))
 SessionLocal = sessionmaker(autoflush=False, bind=engine)
+
+async_engine = create_async_engine(
+    settings.ASYNC_POSTGRES_URI, **_pool_options("async", True)
+)
+# Objects are kept loaded after a commit since lazy loading isn't
+# possible with an AsyncSession.
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
+pool_collector.register(engine)
+pool_collector.register(async_engine.sync_engine)
+observe_statements(engine, "sync")
+observe_statements(async_engine.sync_engine, "async")
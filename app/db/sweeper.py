@@ -0,0 +1,99 @@
+"""Purge of expired sessions.
+
+A `DeviceLogin` is otherwise only deleted on logout or when its refresh token
+is presented after it expired, abandoned sessions would pile up forever.
+Runs in the background of the app, or once from the command line:
+
+    python -m app.db.sweeper
+"""
+
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional
+
+from loguru import logger
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+from app.models.device_login import DeviceLogin
+
+
+async def sweep_sessions(
+    engine: AsyncEngine,
+    *,
+    batch_size: int = settings.SESSION_SWEEP_BATCH_SIZE,
+    pause: float = settings.SESSION_SWEEP_PAUSE,
+) -> int:
+    """Delete the expired sessions and return how many there were.
+
+    Each batch is its own short transaction, rows locked by a concurrent
+    refresh or logout are skipped rather than waited for.
+    """
+    # Sessions are stored as naive UTC timestamps
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    expired = (
+        select(DeviceLogin.user_id, DeviceLogin.session_id)
+        .where(DeviceLogin.expires_at < now)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = delete(DeviceLogin).where(
+        tuple_(DeviceLogin.user_id, DeviceLogin.session_id).in_(expired)
+    )
+
+    purged = 0
+    while True:
+        async with engine.begin() as conn:
+            deleted = (await conn.execute(stmt)).rowcount
+        purged += deleted
+        if deleted < batch_size:
+            return purged
+        await asyncio.sleep(pause)
+
+
+class SessionSweeper:
+    """Runs `sweep_sessions` every `interval` seconds"""
+
+    def __init__(self, engine: AsyncEngine, *, interval: float):
+        self.engine = engine
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                purged = await sweep_sessions(self.engine)
+                logger.info(f"Purged {purged} expired sessions")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+async def _main() -> None:
+    from app.db.session import async_engine
+
+    try:
+        purged = await sweep_sessions(async_engine)
+        logger.info(f"Purged {purged} expired sessions")
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,287 @@
+"""Bulk import of users, e.g. when onboarding a partner.
+
+The input, CSV with a header row or one JSON object per line, is read and
+validated against `UserCreate` a chunk at a time. The valid rows of a chunk
+are copied with COPY into a staging table and merged into the users with
+INSERT ... ON CONFLICT DO NOTHING, in a transaction of their own. Rows that
+are invalid or whose uid or email is taken are reported with their line
+number and skipped, the rest is imported. Only one chunk is held in memory,
+whatever the size of the input.
+
+In CSV, `roles` and `tags` are comma separated within their cell. Missing
+images default to `DEFAULT_USER_IMAGE` and missing phone numbers to none.
+The input must be UTF-8, a row that isn't is reported like any invalid row.
+
+    python -m app.db.user_import partner.csv > errors.ndjson
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import sys
+from dataclasses import asdict, dataclass
+from enum import Enum
+from typing import Any, AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple
+
+import orjson
+from loguru import logger
+from pydantic import ValidationError
+from sqlalchemy import String, column, inspect, select, table, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.core.config import settings
+from app.models.user import User
+from app.schemas.user import UserCreate
+
+# Values are kept as they come, the cell of a CSV row or the JSON value
+Row = Tuple[int, Any]
+
+STAGING = "user_import"
+
+_mapper = inspect(User)
+# Attributes and their columns, in the order of the table
+_ATTRS = [attr.key for attr in _mapper.column_attrs]
+_COLUMNS = [attr.columns[0] for attr in _mapper.column_attrs]
+# Checked beforehand since one value too long would fail the whole COPY
+_MAX_LENGTHS = {
+    key: col.type.length
+    for key, col in zip(_ATTRS, _COLUMNS)
+    if isinstance(col.type, String) and col.type.length
+}
+_UID = _mapper.get_property("uid").columns[0]
+
+_staging = table(STAGING, *(column(col.name) for col in _COLUMNS))
+_merge = (
+    pg_insert(User.__table__)
+    .from_select([col.name for col in _COLUMNS], select(*_staging.c))
+    .on_conflict_do_nothing()
+    .returning(_UID)
+)
+
+
+class ImportFormat(str, Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+    @classmethod
+    def from_filename(cls, filename: str) -> Optional["ImportFormat"]:
+        suffix = filename.rsplit(".", 1)[-1].lower()
+        return {"csv": cls.CSV, "ndjson": cls.NDJSON, "jsonl": cls.NDJSON}.get(suffix)
+
+    @classmethod
+    def from_content_type(cls, content_type: str) -> Optional["ImportFormat"]:
+        return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+
+
+CONTENT_TYPES = {
+    "text/csv": ImportFormat.CSV,
+    "application/x-ndjson": ImportFormat.NDJSON,
+    "application/jsonl": ImportFormat.NDJSON,
+}
+
+
+@dataclass
+class RowError:
+    line: int
+    uid: Optional[str]
+    error: str
+
+
+@dataclass
+class ImportSummary:
+    rows: int = 0
+    imported: int = 0
+    failed: int = 0
+
+
+def read_csv(f: BinaryIO) -> Iterator[Row]:
+    # Undecodable bytes are kept as surrogates for `validate` to reject the
+    # row they are in, rather than failing the whole input
+    text = io.TextIOWrapper(f, "utf-8", errors="surrogateescape", newline="")
+    reader = csv.DictReader(text)
+    for record in reader:
+        # Cells beyond the header are keyed by None
+        record.pop(None, None)
+        for field in ("roles", "tags"):
+            if field in record:
+                values = record[field].split(",") if record[field] else []
+                record[field] = [value.strip() for value in values]
+        if record.get("phone_number") == "":
+            record["phone_number"] = None
+        yield reader.line_num, record
+
+
+def read_ndjson(f: BinaryIO) -> Iterator[Row]:
+    for line, data in enumerate(f, 1):
+        if not data.strip():
+            continue
+        # orjson decodes the line, invalid UTF-8 is a JSONDecodeError
+        try:
+            yield line, orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            yield line, e
+
+
+READERS = {ImportFormat.CSV: read_csv, ImportFormat.NDJSON: read_ndjson}
+
+
+def _error_message(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(
+            f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+            for error in e.errors()
+        )
+    return str(e)
+
+
+def _is_text(value: Any) -> bool:
+    """Whether `value` is a string Postgres can store, one with NUL or
+    undecoded bytes would fail the whole COPY"""
+    if not isinstance(value, str) or "\x00" in value:
+        return False
+    try:
+        value.encode()
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def validate(record: Any) -> UserCreate:
+    """The user of an input row, raises ValueError if it's not valid"""
+    if isinstance(record, Exception):
+        raise ValueError(f"Invalid row: {record}")
+    if not isinstance(record, dict):
+        raise ValueError("Invalid row: not an object")
+
+    user = UserCreate.model_validate(
+        {"image": settings.DEFAULT_USER_IMAGE, "phone_number": None, **record}
+    )
+    for field, value in user:
+        values = value if isinstance(value, list) else [value]
+        if any(isinstance(v, str) and not _is_text(v) for v in values):
+            raise ValueError(f"{field}: NUL character or invalid UTF-8")
+    for field, length in _MAX_LENGTHS.items():
+        value = getattr(user, field)
+        if value is not None and len(value) > length:
+            raise ValueError(f"{field}: longer than {length} characters")
+    return user
+
+
+def _next_chunk(
+    rows: Iterator[Row], size: int
+) -> Tuple[List[Tuple[int, UserCreate]], List[RowError], int]:
+    """Read and validate up to `size` rows"""
+    users, errors, read = [], [], 0
+    uids, emails = set(), set()
+    for line, record in rows:
+        read += 1
+        try:
+            user = validate(record)
+        except ValueError as e:
+            uid = record.get("uid") if isinstance(record, dict) else None
+            if not _is_text(uid):
+                uid = None
+            errors.append(RowError(line, uid, _error_message(e)))
+        else:
+            # Within a statement the later duplicate would silently win
+            if user.uid in uids or user.email in emails:
+                errors.append(RowError(line, user.uid, "Duplicate uid or email"))
+            else:
+                uids.add(user.uid)
+                emails.add(user.email)
+                users.append((line, user))
+        if read == size:
+            break
+    return users, errors, read
+
+
+async def _load(engine: AsyncEngine, users: List[UserCreate]) -> set:
+    """COPY `users` to the staging table and merge them, returns the uids
+    that were inserted"""
+    records = [tuple(getattr(user, key) for key in _ATTRS) for user in users]
+    async with engine.begin() as conn:
+        # Created per transaction, consecutive ones may not share a server
+        # connection behind PgBouncer
+        await conn.execute(
+            text(
+                f"CREATE TEMPORARY TABLE {STAGING} "
+                f'(LIKE {settings.SCHEMA_NAME}."user") ON COMMIT DROP'
+            )
+        )
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            STAGING, records=records, columns=[col.name for col in _COLUMNS]
+        )
+        return set((await conn.execute(_merge)).scalars())
+
+
+async def import_users(
+    engine: AsyncEngine,
+    rows: Iterator[Row],
+    summary: ImportSummary,
+    *,
+    chunk_size: int = 1000,
+) -> AsyncIterator[RowError]:
+    """Import the users of `rows`, yielding the errors as they are found.
+
+    `summary` is kept up to date. Rows are read in a thread, they may come
+    from a file.
+    """
+    while True:
+        users, errors, read = await asyncio.to_thread(_next_chunk, rows, chunk_size)
+        if read == 0:
+            return
+        summary.rows += read
+        for error in errors:
+            summary.failed += 1
+            yield error
+
+        if not users:
+            continue
+        imported = await _load(engine, [user for _, user in users])
+        summary.imported += len(imported)
+        for line, user in users:
+            if user.uid not in imported:
+                summary.failed += 1
+                yield RowError(line, user.uid, "User already exists")
+        # Users that didn't exist were never cached, nothing to invalidate
+        logger.debug(f"Imported {summary.imported} of {summary.rows} users")
+
+
+def dumps(item: Any) -> bytes:
+    """NDJSON line of a `RowError` or `ImportSummary`"""
+    return orjson.dumps(asdict(item)) + b"\n"
+
+
+async def _main() -> None:
+    from app.db.session import async_engine
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", help="CSV or NDJSON file, - for stdin")
+    parser.add_argument("--format", type=ImportFormat, choices=list(ImportFormat))
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    fmt = args.format or ImportFormat.from_filename(args.file)
+    if fmt is None:
+        parser.error("unknown format, use --format")
+
+    summary = ImportSummary()
+    f = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    try:
+        async for error in import_users(
+            async_engine, READERS[fmt](f), summary, chunk_size=args.chunk_size
+        ):
+            sys.stdout.buffer.write(dumps(error))
+    finally:
+        f.close()
+        await async_engine.dispose()
+    logger.info(
+        f"Imported {summary.imported} of {summary.rows} users, {summary.failed} failed"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -21,3 +21,9 @@ class APIException(HTTPException):
 class FileFormatException(APIException):
     status_code = 400
     detail = "Invalid File Format"
+
+
+class ServiceBusyException(APIException):
+    status_code = 503
+    detail = "Server is busy, try again later"
+    headers = {"Retry-After": "1"}
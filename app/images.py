@@ -0,0 +1,252 @@
+import asyncio
+import glob
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from loguru import logger
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.exception import ServiceBusyException
+
+T = TypeVar("T")
+
+ALLOWED_FORMATS = ("JPEG", "PNG", "BMP")
+
+# Profile images are stored as `static/user/users/{uid}/{md5}.jpg` and their
+# variants as `{md5}_{variant}.{ext}` next to them.
+_ORIGINAL_RE = re.compile(r"^/static/user/users/([^/]+)/([0-9a-f]{32})\.jpg$")
+_VARIANT_RE = re.compile(
+    r"^user/users/(?P<uid>[^/]+)/(?P<md5>[0-9a-f]{32})"
+    r"_(?P<variant>[a-z]+)\.(?P<ext>jpg|webp)$"
+)
+_VARIANT_FORMATS = {"jpg": "JPEG", "webp": "WEBP"}
+
+
+class ImageFormatError(ValueError):
+    pass
+
+
+def _save_atomic(img: Image.Image, dest: str, **params: Any) -> None:
+    # Write to a temporary file first so a concurrent reader never sees a
+    # partially written image.
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    img.save(tmp, **params)
+    os.replace(tmp, dest)
+
+
+def process_profile_image(data: bytes, dest: str) -> Dict[str, float]:
+    """Decode an uploaded image and store it as an optimized progressive JPEG.
+
+    Meant to run in a worker of the image pool. Returns the duration of each
+    stage in milliseconds.
+    """
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+
+    def stage(name: str) -> None:
+        nonlocal start
+        now = time.perf_counter()
+        timings[name] = (now - start) * 1000
+        start = now
+
+    try:
+        img = Image.open(BytesIO(data))
+        img.load()
+    except Exception:
+        raise ImageFormatError("Invalid File Format")
+    if img.format not in ALLOWED_FORMATS:
+        raise ImageFormatError("Image format must be JPEG or PNG.")
+    stage("decode")
+
+    img = ImageOps.exif_transpose(img)
+    stage("transpose")
+
+    img = img.convert("RGB")
+    stage("convert")
+
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    _save_atomic(
+        img,
+        dest,
+        format="JPEG",
+        quality="web_high",
+        optimize=True,
+        progressive=True,
+    )
+    stage("encode")
+
+    return timings
+
+
+def render_variant(src: str, dest: str, size: int, fmt: str) -> Dict[str, float]:
+    """Render a downscaled copy of a stored profile image.
+
+    Meant to run in a worker of the image pool. Returns the duration of each
+    stage in milliseconds.
+    """
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+
+    with Image.open(src) as img:
+        # Let the JPEG decoder skip straight to a reduced scale
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+    timings["decode"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+
+    img.thumbnail((size, size), Image.Resampling.LANCZOS)
+    timings["resize"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+
+    if fmt == "WEBP":
+        _save_atomic(img, dest, format="WEBP", quality=80, method=4)
+    else:
+        _save_atomic(
+            img,
+            dest,
+            format="JPEG",
+            quality="web_high",
+            optimize=True,
+            progressive=True,
+        )
+    timings["encode"] = (time.perf_counter() - start) * 1000
+
+    return timings
+
+
+def parse_variant(path: str) -> Optional[Tuple[str, str, int, str]]:
+    """Map a static path of a variant to `(original, variant, size, format)`.
+
+    `path` is relative to the static directory, `None` is returned if it
+    doesn't name a known variant.
+    """
+    match = _VARIANT_RE.match(path)
+    if match is None:
+        return None
+
+    size = settings.IMAGE_VARIANTS.get(match["variant"])
+    if size is None or (match["ext"] == "webp" and not settings.IMAGE_WEBP):
+        return None
+
+    original = f"user/users/{match['uid']}/{match['md5']}.jpg"
+    return original, match["variant"], size, _VARIANT_FORMATS[match["ext"]]
+
+
+def variant_urls(image: str) -> Dict[str, str]:
+    """URLs of every variant of a profile image.
+
+    Images that aren't content addressed, like the default one, have no
+    variants so they are used as is for every size.
+    """
+    match = _ORIGINAL_RE.match(image)
+    if match is None:
+        return {name: image for name in settings.IMAGE_VARIANTS}
+
+    uid, md5sum = match.groups()
+    ext = "webp" if settings.IMAGE_WEBP else "jpg"
+    return {
+        name: f"/static/user/users/{uid}/{md5sum}_{name}.{ext}"
+        for name in settings.IMAGE_VARIANTS
+    }
+
+
+def remove_profile_image(image: str) -> None:
+    """Delete a stored profile image along with its rendered variants."""
+    match = _ORIGINAL_RE.match(image)
+    if match is None:
+        return
+
+    uid, md5sum = match.groups()
+    for path in glob.glob(f"static/user/users/{uid}/{md5sum}*"):
+        os.remove(path)
+
+
+class ImagePool:
+    """Bounded pool of worker processes for CPU heavy image work.
+
+    At most `workers` jobs run at once and up to `queue_size` more may wait
+    for a free worker; anything beyond that is rejected right away with a
+    503 instead of piling up. A job holds its slot until it has finished in
+    the worker, even if the request that submitted it went away. With
+    `workers=0` jobs run in a thread pool, which avoids spawning processes
+    in development and tests.
+
+    A worker that dies (killed for memory, crashed in a decoder) breaks the
+    whole process pool, it is then replaced and the job retried once.
+    """
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.capacity = max(workers, 1) + queue_size
+        self._pending = 0
+        # Jobs are released from the executor's threads
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(thread_name_prefix="image")
+        return self._executor
+
+    def _discard(self, executor: Executor) -> None:
+        if self._executor is executor:
+            self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self, _: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def _submit(self, executor: Executor, fn: Callable[..., T], *args: Any) -> Future:
+        with self._lock:
+            if self._pending >= self.capacity:
+                raise ServiceBusyException()
+            self._pending += 1
+
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        for _ in range(2):
+            executor = self._get_executor()
+            try:
+                return await asyncio.wrap_future(self._submit(executor, fn, *args))
+            except BrokenProcessPool:
+                logger.error("An image worker died, replacing the pool")
+                self._discard(executor)
+        raise ServiceBusyException()
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._discard(self._executor)
+
+
+image_pool = ImagePool(settings.IMAGE_POOL_WORKERS, settings.IMAGE_POOL_QUEUE_SIZE)
@@ -1,19 +1,33 @@
 from contextlib import asynccontextmanager
 
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import ORJSONResponse
-from fastapi.staticfiles import StaticFiles
 from app.db.init_db import init_db
+from app.db.notify import InvalidationListener
+from app.db.session import async_engine
+from app.db.sweeper import SessionSweeper
+from app.images import image_pool
+from app.static import ImageStaticFiles
 from fastapi import FastAPI
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from app.metrics import MetricsMiddleware
 from app.api import router as api_router
+from app.api import well_known
 from app.core.config import settings
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     init_db()
+    listener = InvalidationListener(settings.POSTGRES_DIRECT_URI)
+    listener.start()
+    sweeper = SessionSweeper(async_engine, interval=settings.SESSION_SWEEP_INTERVAL)
+    sweeper.start()
     yield
+    await sweeper.stop()
+    await listener.stop()
+    image_pool.shutdown()
 
 
 app = FastAPI(
@@ -31,7 +45,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+app.mount("/static", ImageStaticFiles(directory="static"), name="static")
 app.include_router(api_router, prefix=settings.API_V1_STR)
+app.include_router(well_known.router)
@@ -0,0 +1,174 @@
+import time
+from functools import wraps
+from inspect import iscoroutinefunction
+from typing import Callable, Dict, TypeVar
+
+from prometheus_client import REGISTRY, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.cache import TTLCache
+
+# Labels only ever take values from fixed sets (route templates rather than
+# paths, statement verbs rather than statements) so that the number of
+# series stays bounded.
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve a request",
+    ["method", "route", "status"],
+)
+STATEMENT_LATENCY = Histogram(
+    "db_statement_duration_seconds",
+    "Time to execute a statement, as seen by the driver",
+    ["engine", "statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+OPERATION_LATENCY = Histogram(
+    "operation_duration_seconds",
+    "Time spent in CPU heavy operations (token crypto, image processing)",
+    ["operation"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+
+_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+F = TypeVar("F", bound=Callable)
+
+
+class CacheCollector(Collector):
+    """Exports the statistics of the in-process caches at scrape time.
+
+    The hit rate is `rate(cache_hits_total) / rate(cache_requests_total)`.
+    """
+
+    def __init__(self) -> None:
+        self._caches: Dict[str, TTLCache] = {}
+
+    def register(self, name: str, cache: TTLCache) -> None:
+        self._caches[name] = cache
+
+    def collect(self):
+        entries = GaugeMetricFamily(
+            "cache_entries", "Entries currently stored", labels=["cache"]
+        )
+        counters = {
+            stat: CounterMetricFamily(f"cache_{stat}", doc, labels=["cache"])
+            for stat, doc in (
+                ("requests", "Lookups"),
+                ("hits", "Lookups that found a live entry"),
+                ("evictions", "Entries dropped to stay under the size limit"),
+                ("expirations", "Entries dropped once their TTL ran out"),
+            )
+        }
+        for name, cache in self._caches.items():
+            stats = cache.stats()
+            stats["requests"] = stats["hits"] + stats["misses"]
+            entries.add_metric([name], stats["entries"])
+            for stat, counter in counters.items():
+                counter.add_metric([name], stats[stat])
+
+        yield entries
+        yield from counters.values()
+
+
+cache_collector = CacheCollector()
+REGISTRY.register(cache_collector)
+
+
+class MetricsMiddleware:
+    """Records the latency of every request by route template and status"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            method = scope["method"] if scope["method"] in _METHODS else "OTHER"
+            REQUEST_LATENCY.labels(method, _route(scope), status).observe(
+                time.perf_counter() - start
+            )
+
+
+def _route(scope: Scope) -> str:
+    # The router adds the matched route to the scope
+    route = scope.get("route")
+    if route is not None:
+        return route.path_format
+    if "app_root_path" in scope:
+        # Mounted app, e.g. the static files
+        return f"{scope['root_path'][len(scope['app_root_path']):]}/{{path}}"
+    return "unmatched"
+
+
+def observe_statements(engine: Engine, name: str) -> None:
+    """Record the execution time of the statements run through `engine`"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["statement_start"].pop()
+        head = statement[:32].split(None, 1)
+        verb = head[0].upper() if head else "OTHER"
+        STATEMENT_LATENCY.labels(
+            name, verb if verb in _STATEMENTS else "OTHER"
+        ).observe(elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches `after_cursor_execute`
+        if context.connection is not None:
+            starts = context.connection.info.get("statement_start")
+            if starts:
+                starts.pop()
+
+
+def timed(operation: str) -> Callable[[F], F]:
+    """Record the duration of every call of the decorated function"""
+    histogram = OPERATION_LATENCY.labels(operation)
+
+    def decorator(fn: F) -> F:
+        if iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start)
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import ForeignKey, ForeignKey
+from sqlalchemy import BigInteger, ForeignKey, ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.models.user import User
@@ -10,6 +10,6 @@ class DeviceLogin(Base):
     user_id: Mapped[str] = mapped_column(
         ForeignKey(User.uid, ondelete="CASCADE"), primary_key=True
     )
-    session_id: Mapped[int] = mapped_column(primary_key=True)
+    session_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
     refreshed_at: Mapped[datetime]
-    expires_at: Mapped[datetime]
+    expires_at: Mapped[datetime] = mapped_column(index=True)
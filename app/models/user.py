@@ -1,15 +1,23 @@
 from typing import Optional
 from typing import List
 
-from sqlalchemy import String, Integer, Boolean, Text, ARRAY
+from sqlalchemy import String, Integer, Boolean, Text, ARRAY, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.ext.mutable import MutableList
 from sqlalchemy.dialects.postgresql import ARRAY
 
+from app.core.config import settings
 from app.db.base_class import Base
 
 
 class User(Base):
+    __table_args__ = (
+        # Containment (@>) and overlap (&&) searches on the arrays
+        Index("ix_user_tags", "tags", postgresql_using="gin"),
+        Index("ix_user_roles", "roles", postgresql_using="gin"),
+        {"schema": settings.SCHEMA_NAME},
+    )
+
     uid: Mapped[str] = mapped_column("id", String(28), primary_key=True)
     email: Mapped[str] = mapped_column(
         "email", String(64), unique=True, index=True, nullable=False
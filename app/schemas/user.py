@@ -1,12 +1,13 @@
 from enum import Enum
 from re import L
-from typing import Optional, List
+from typing import Dict, Optional, List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, computed_field
 
 from app.core.config import settings
 
-from app.utils import ValidateFromJson
+from app.utils import ValidateFromJson, record_serializer
+from app.images import variant_urls
 
 
 class ScopeEnum(str, Enum):
@@ -17,6 +18,13 @@ class ScopeEnum(str, Enum):
     ADMIN = "admin"
 
 
+class MatchEnum(str, Enum):
+    """How a search combines the requested tags or roles"""
+
+    ALL = "all"
+    ANY = "any"
+
+
 class User(BaseModel):
     email: str
     f_name: str
@@ -41,6 +49,61 @@ class UserUpdate(BaseModel, ValidateFromJson):
     tags: Optional[List[str]]
 
 
-class UserInDB(User):
+class UserRecord(User):
+    """The stored columns of a user"""
+
+    uid: str
+    image: str
+
+
+class UserPublic(BaseModel):
+    """What anyone may see of a user, e.g. on a profile card"""
+
     uid: str
+    f_name: str
+    l_name: str
     image: str
+
+    @computed_field
+    @property
+    def images(self) -> Dict[str, str]:
+        """URLs of the resized variants of `image`, by variant name"""
+        return variant_urls(self.image)
+
+
+class UserInDB(UserRecord):
+    @computed_field
+    @property
+    def images(self) -> Dict[str, str]:
+        """URLs of the resized variants of `image`, by variant name"""
+        return variant_urls(self.image)
+
+
+def _images(record) -> Dict[str, str]:
+    return variant_urls(record["image"])
+
+
+# For records read as plain rows, see `CRUDBase.aget_record`
+serialize_user_record = record_serializer(UserInDB, images=_images)
+serialize_user_public = record_serializer(UserPublic, images=_images)
+
+
+class UserBatchRequest(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=settings.USER_BATCH_MAX_SIZE)
+
+
+class UserBatch(BaseModel):
+    users: List[UserInDB]
+    missing: List[str]
+
+
+class UserPage(BaseModel):
+    items: List[UserInDB]
+    next_cursor: Optional[str]
+
+
+class UserPublicPage(BaseModel):
+    """A page of search results for callers that aren't admins"""
+
+    items: List[UserPublic]
+    next_cursor: Optional[str]
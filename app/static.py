@@ -0,0 +1,210 @@
+import asyncio
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+from app.images import image_pool, parse_variant, render_variant
+
+# Files whose name is derived from their content, they never change
+_CONTENT_ADDRESSED_RE = re.compile(
+    r"^user/users/[^/]+/(?P<name>[0-9a-f]{32}(?:_[a-z]+)?\.(?:jpg|webp))$"
+)
+_DEFAULT_IMAGE_PREFIX = "user/-1/"
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes` range into inclusive offsets.
+
+    `None` means the header should be ignored and the whole file sent, which
+    is also what happens for multiple ranges.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+
+    try:
+        if first == "":
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - length, 0), size - 1
+
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start >= size:
+        raise RangeNotSatisfiable()
+    if start > end:
+        return None
+
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(FileResponse):
+    """`FileResponse` that answers single byte range requests with a 206."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        request_headers = Headers(scope=scope)
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+
+        if (
+            self.status_code != 200
+            or range_header is None
+            or (if_range is not None and if_range != self.headers.get("etag"))
+        ):
+            await super().__call__(scope, receive, send)
+            return
+
+        size = int(self.headers["content-length"])
+        try:
+            byte_range = _parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            response = Response(
+                status_code=416, headers={"content-range": f"bytes */{size}"}
+            )
+            await response(scope, receive, send)
+            return
+
+        if byte_range is None:
+            await super().__call__(scope, receive, send)
+            return
+
+        start, end = byte_range
+        self.status_code = 206
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                remaining -= len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": remaining > 0 and len(chunk) > 0,
+                    }
+                )
+                if not chunk:
+                    break
+
+
+class ImageStaticFiles(StaticFiles):
+    """Static files tuned for content addressed profile images.
+
+    Profile images have the MD5 of their content in their name, so they are
+    served as immutable with a strong ETag derived from that name, which
+    lets conditional requests be answered without touching the disk. The
+    default image may change and only gets a short TTL.
+
+    A missing variant is rendered from the original, cached on disk next to
+    it and served like any other file from then on.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._rendering: Dict[str, asyncio.Task] = {}
+        self._immutable = (
+            f"public, max-age={settings.STATIC_IMMUTABLE_MAX_AGE}, immutable"
+        )
+        self._short_ttl = f"public, max-age={settings.STATIC_DEFAULT_MAX_AGE}"
+
+    def _cache_headers(self, path: str) -> Dict[str, str]:
+        match = _CONTENT_ADDRESSED_RE.match(path)
+        if match is not None:
+            return {"etag": f'"{match["name"]}"', "cache-control": self._immutable}
+        if path.startswith(_DEFAULT_IMAGE_PREFIX):
+            return {"cache-control": self._short_ttl}
+        return {}
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        path = path.replace(os.sep, "/")
+        headers = self._cache_headers(path)
+        if "etag" in headers and scope["method"] in ("GET", "HEAD"):
+            if_none_match = Headers(scope=scope).get("if-none-match", "")
+            tags = [tag.strip(" W/") for tag in if_none_match.split(",")]
+            if headers["etag"] in tags or "*" in tags:
+                return NotModifiedResponse(Headers(headers))
+
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            variant = parse_variant(path)
+            if variant is None:
+                raise
+
+        await self._render(path, *variant)
+        return await super().get_response(path, scope)
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        path = os.path.relpath(full_path, os.path.realpath(self.directory))
+        response = RangeFileResponse(
+            full_path,
+            status_code=status_code,
+            headers=self._cache_headers(path.replace(os.sep, "/")),
+            stat_result=stat_result,
+        )
+        response.headers["accept-ranges"] = "bytes"
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def _render(
+        self, path: str, original: str, variant: str, size: int, fmt: str
+    ) -> None:
+        src, src_stat = self.lookup_path(original)
+        if src_stat is None:
+            raise HTTPException(status_code=404)
+        dest = os.path.join(os.path.dirname(src), os.path.basename(path))
+
+        # Concurrent requests for the same variant share a single render
+        task = self._rendering.get(dest)
+        if task is None:
+            task = asyncio.ensure_future(
+                image_pool.run(render_variant, src, dest, size, fmt)
+            )
+            self._rendering[dest] = task
+            task.add_done_callback(lambda _: self._rendering.pop(dest, None))
+
+        await asyncio.shield(task)
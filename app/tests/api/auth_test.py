@@ -0,0 +1,82 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.security import HTTPAuthorizationCredentials
+from prometheus_client import generate_latest
+
+from app.api import auth_deps
+from app.cache import TTLCache
+from app.core.config import settings
+
+
+def _access_token(**claims) -> HTTPAuthorizationCredentials:
+    iat = datetime.now(timezone.utc)
+    payload = {
+        "sub": "some_user",
+        "name": "Some User",
+        "scopes": ["user"],
+        "tags": [],
+        "type": auth_deps.ACCESS_TOKEN_TYPE,
+        "iat": iat,
+        "exp": iat + settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+        **claims,
+    }
+    token = auth_deps.create_token(payload)
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+@pytest.fixture()
+def decodes(monkeypatch: pytest.MonkeyPatch):
+    calls = []
+    decode_token = auth_deps.decode_token
+
+    def counting_decode_token(token):
+        calls.append(token)
+        return decode_token(token)
+
+    monkeypatch.setattr(auth_deps, "decode_token", counting_decode_token)
+    return calls
+
+
+def test_access_token_is_verified_once(decodes):
+    cred = _access_token()
+    first = asyncio.run(auth_deps.get_auth_data(cred))
+    second = asyncio.run(auth_deps.get_auth_data(cred))
+
+    assert first.sub == second.sub == "some_user"
+    assert len(decodes) == 1
+
+
+def test_revoked_access_token_is_rejected(decodes):
+    cred = _access_token()
+    assert asyncio.run(auth_deps.get_auth_data(cred)) is not None
+
+    auth_deps.revoke_access_token(cred.credentials)
+    assert asyncio.run(auth_deps.get_auth_data(cred)) is None
+
+
+def test_revocation_outlives_the_cache(monkeypatch: pytest.MonkeyPatch):
+    # The cache may hold nothing at all, a revocation still holds
+    monkeypatch.setattr(auth_deps, "access_tokens", TTLCache(0, ttl=0))
+    creds = [_access_token(sub=f"user_{i}") for i in range(3)]
+    for cred in creds:
+        auth_deps.revoke_access_token(cred.credentials)
+
+    for cred in creds:
+        assert asyncio.run(auth_deps.get_auth_data(cred)) is None
+    assert asyncio.run(auth_deps.get_auth_data(_access_token(sub="user_3"))) is not None
+
+
+def test_refresh_token_is_not_cached(decodes):
+    cred = _access_token(type=auth_deps.REFRESH_TOKEN_TYPE)
+    assert asyncio.run(auth_deps.get_auth_data(cred)) is None
+    assert asyncio.run(auth_deps.get_auth_data(cred)) is None
+    assert len(decodes) == 2
+
+
+def test_cache_metrics():
+    asyncio.run(auth_deps.get_auth_data(_access_token()))
+    metrics = generate_latest().decode()
+    assert 'cache_requests_total{cache="access_token"}' in metrics
+    assert 'cache_hits_total{cache="user"}' in metrics
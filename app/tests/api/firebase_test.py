@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.api import auth_deps
+from app.api.firebase_keys import FirebaseKeyStore
+from app.tests.firebase_stub import KEY_ID, FirebaseStub
+
+
+@pytest.fixture()
+def firebase_stub(monkeypatch: pytest.MonkeyPatch):
+    with FirebaseStub() as stub:
+        monkeypatch.setattr(auth_deps, "firebase_keys", FirebaseKeyStore(stub.url))
+        yield stub
+
+
+def test_verify_firebasetoken(firebase_stub: FirebaseStub):
+    token = firebase_stub.mint_token("some_user")
+    decoded = asyncio.run(auth_deps.verify_firebasetoken(token))
+    assert decoded["user_id"] == "some_user"
+
+
+def test_verify_firebasetoken_bad_signature(firebase_stub: FirebaseStub):
+    with FirebaseStub() as other:
+        token = other.mint_token("some_user")
+
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(auth_deps.verify_firebasetoken(token))
+    assert e.value.status_code == 401
+
+
+def test_verify_firebasetoken_bad_audience(firebase_stub: FirebaseStub):
+    token = firebase_stub.mint_token("some_user", aud="someone-else")
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(auth_deps.verify_firebasetoken(token))
+    assert e.value.detail == "Invalid audience"
+
+
+@pytest.mark.parametrize(
+    "claims,detail",
+    [
+        ({"exp": 1}, "Signature has expired"),
+        ({"iat": 2**32}, "Token issued in the future"),
+    ],
+)
+def test_verify_firebasetoken_times(firebase_stub: FirebaseStub, claims, detail):
+    token = firebase_stub.mint_token("some_user", **claims)
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(auth_deps.verify_firebasetoken(token))
+    assert e.value.detail == detail
+
+
+def test_key_store_deduplicates_refreshes():
+    async def lookup(store: FirebaseKeyStore):
+        return await asyncio.gather(*(store.get_key(KEY_ID) for _ in range(20)))
+
+    with FirebaseStub() as stub:
+        store = FirebaseKeyStore(stub.url)
+        keys = asyncio.run(lookup(store))
+        assert all(key is not None for key in keys)
+        assert stub.requests == 1
+
+
+def test_key_store_backs_off_after_failed_refresh():
+    async def lookups(store: FirebaseKeyStore):
+        keys = []
+        for _ in range(10):
+            keys.append(await store.get_key(KEY_ID))
+            # Let the background refresh run
+            await asyncio.sleep(0.01)
+        return keys
+
+    with FirebaseStub(max_age=0) as stub:
+        store = FirebaseKeyStore(stub.url, min_refresh_interval=60)
+        assert asyncio.run(store.get_key(KEY_ID)) is not None
+
+        stub.status = 503
+        keys = asyncio.run(lookups(store))
+        assert all(key is not None for key in keys)
+        # The first lookup triggers a refresh, the failure defers the next
+        assert stub.requests == 2
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from app import crud
+from app.api import auth_deps
+from app.api.firebase_keys import FirebaseKeyStore
+from app.core.config import settings
+from app.crud.base import BadSelectorKey
+from app.models.device_login import DeviceLogin
+from app.models.user import User
+from app.tests.conftest import SessionTesting
+from app.tests.firebase_stub import FirebaseStub
+
+test_user = {
+    "uid": "session_user",
+    "email": "session@email.com",
+    "f_name": "Session",
+    "l_name": "User",
+    "roles": ["user"],
+    "verified": True,
+    "tags": [],
+    "image": "https://test.com/image.jpg",
+}
+
+
+@pytest.fixture(autouse=True)
+def setup_database(seed_db: SessionTesting):
+    user = User(**test_user)
+    seed_db.add(user)
+    seed_db.commit()
+    yield
+    seed_db.delete(user)
+    seed_db.commit()
+
+
+def _session(seed_db: SessionTesting, session_id: int) -> str:
+    """Store a session last refreshed a while ago and return its token"""
+    iat = datetime.now(timezone.utc).replace(microsecond=0) - timedelta(seconds=5)
+    expires_at = iat + settings.ACCESS_TOKEN_EXPIRE_MINUTES
+    seed_db.add(
+        DeviceLogin(
+            user_id=test_user["uid"],
+            session_id=session_id,
+            refreshed_at=iat.replace(tzinfo=None),
+            expires_at=expires_at.replace(tzinfo=None),
+        )
+    )
+    seed_db.commit()
+    return auth_deps.create_token(
+        {
+            "iat": iat,
+            "exp": expires_at,
+            "sub": test_user["uid"],
+            "type": auth_deps.REFRESH_TOKEN_TYPE,
+            "sid": session_id,
+        }
+    )
+
+
+def test_refresh(
+    db: SessionTesting, seed_db: SessionTesting, client: TestClient, statements
+):
+    token = _session(seed_db, 1)
+    statements.clear()
+
+    client.cookies["refresh"] = token
+    response = client.post("/api/user/refresh")
+    assert response.status_code == 200
+    assert (
+        auth_deps.decode_token(response.json()["access_token"])["sub"] == "session_user"
+    )
+    assert len(statements) == 1
+
+    # The exchanged token must not be accepted again
+    client.cookies.clear()
+    client.cookies["refresh"] = token
+    assert client.post("/api/user/refresh").status_code == 401
+    assert seed_db.get(DeviceLogin, ("session_user", 1)) is None
+
+
+def test_logout(db: SessionTesting, seed_db: SessionTesting, client: TestClient):
+    client.cookies["refresh"] = _session(seed_db, 1)
+    response = client.post("/api/user/logout")
+    assert response.status_code == 200
+    assert seed_db.get(DeviceLogin, ("session_user", 1)) is None
+
+    assert client.post("/api/user/logout").status_code == 401
+
+
+def test_concurrent_logins(
+    seed_db: SessionTesting, client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    logins = 32
+    with FirebaseStub() as stub:
+        monkeypatch.setattr(auth_deps, "firebase_keys", FirebaseKeyStore(stub.url))
+        token = stub.mint_token(test_user["uid"])
+
+        def login(_):
+            return client.post(
+                "/api/user/login", headers={"Authorization": f"Bearer {token}"}
+            )
+
+        with ThreadPoolExecutor(max_workers=logins) as pool:
+            responses = list(pool.map(login, range(logins)))
+
+    assert [response.status_code for response in responses] == [200] * logins
+    sessions = seed_db.scalars(
+        select(DeviceLogin.session_id).where(DeviceLogin.user_id == test_user["uid"])
+    ).all()
+    assert len(set(sessions)) == logins
+
+
+def test_get_many_composite_keys(seed_db: SessionTesting):
+    for session_id in (1, 2, 3):
+        _session(seed_db, session_id)
+
+    uid = test_user["uid"]
+    sessions = crud.device_login.get_many(seed_db, [(uid, 1), [uid, 3], (uid, 4)])
+    assert sorted(session.session_id for session in sessions) == [1, 3]
+    assert crud.device_login.get_many(seed_db, [("missing_user", 1)]) == []
+
+    with pytest.raises(BadSelectorKey):
+        crud.device_login.get_many(seed_db, [uid])
@@ -0,0 +1,95 @@
+import io
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from app.core.config import settings
+from app.static import ImageStaticFiles
+
+IMAGE_NAME = "0123456789abcdef0123456789abcdef.jpg"
+IMAGE_PATH = f"/static/user/users/test_user/{IMAGE_NAME}"
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture()
+def static_client(tmp_path):
+    os.makedirs(tmp_path / "user" / "users" / "test_user")
+    os.makedirs(tmp_path / "user" / "-1")
+    (tmp_path / "user" / "users" / "test_user" / IMAGE_NAME).write_bytes(CONTENT)
+    (tmp_path / "user" / "-1" / "default.jpg").write_bytes(CONTENT)
+
+    app = FastAPI()
+    app.mount("/static", ImageStaticFiles(directory=tmp_path), name="static")
+    with TestClient(app) as client:
+        yield client
+
+
+def test_content_addressed_image_is_immutable(static_client: TestClient):
+    response = static_client.get(IMAGE_PATH)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["etag"] == f'"{IMAGE_NAME}"'
+    assert "immutable" in response.headers["cache-control"]
+
+    response = static_client.get(
+        IMAGE_PATH, headers={"If-None-Match": f'"{IMAGE_NAME}"'}
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == f'"{IMAGE_NAME}"'
+
+
+def test_default_image_has_short_ttl(static_client: TestClient):
+    response = static_client.get("/static/user/-1/default.jpg")
+    assert response.status_code == 200
+    assert (
+        response.headers["cache-control"]
+        == f"public, max-age={settings.STATIC_DEFAULT_MAX_AGE}"
+    )
+
+
+@pytest.mark.parametrize(
+    "header,start,end",
+    [("bytes=0-99", 0, 99), ("bytes=1000-", 1000, 1023), ("bytes=-24", 1000, 1023)],
+)
+def test_range_request(static_client: TestClient, header: str, start: int, end: int):
+    response = static_client.get(IMAGE_PATH, headers={"Range": header})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(CONTENT)}"
+    assert response.content == CONTENT[start : end + 1]
+
+
+def test_unsatisfiable_range(static_client: TestClient):
+    response = static_client.get(IMAGE_PATH, headers={"Range": "bytes=5000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+
+
+def test_variant_is_rendered_once(static_client: TestClient, tmp_path):
+    buffer = io.BytesIO()
+    Image.new("RGB", (400, 300), (200, 80, 40)).save(buffer, format="JPEG")
+    (tmp_path / "user" / "users" / "test_user" / IMAGE_NAME).write_bytes(
+        buffer.getvalue()
+    )
+    variant = IMAGE_PATH.replace(".jpg", "_thumb.webp")
+
+    response = static_client.get(variant)
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    with Image.open(io.BytesIO(response.content)) as img:
+        assert img.format == "WEBP"
+        assert img.size == (64, 48)
+
+    rendered = tmp_path / "user" / "users" / "test_user" / os.path.basename(variant)
+    assert rendered.read_bytes() == response.content
+    assert static_client.get(variant).content == response.content
+
+
+def test_unknown_variant_is_not_found(static_client: TestClient, monkeypatch):
+    assert static_client.get(IMAGE_PATH.replace(".jpg", "_huge.jpg")).status_code == 404
+
+    monkeypatch.setattr(settings, "IMAGE_WEBP", False)
+    response = static_client.get(IMAGE_PATH.replace(".jpg", "_thumb.webp"))
+    assert response.status_code == 404
@@ -1,8 +1,25 @@
+import io
+import json
+from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
+from app import crud
+from app.api import auth_deps
+from app.api.firebase_keys import FirebaseKeyStore
+from app.crud import crud_user
+from app.images import ImagePool, variant_urls
+from app.models.device_login import DeviceLogin
 from app.models.user import User
 from fastapi.testclient import TestClient
+from PIL import Image
+from app.api.auth_deps import AuthData
+from app.schemas.user import ScopeEnum, UserInDB
 from app.tests.conftest import SessionTesting
+from app.tests.firebase_stub import FirebaseStub
 
 test_user = {
     "uid": "test_user",
@@ -17,18 +34,351 @@ test_user = {
 }
 
 
+test_user_in_db = {**test_user, "images": variant_urls(test_user["image"])}
+
+
 @pytest.fixture(autouse=True)
-def setup_database(db: SessionTesting):
+def setup_database(seed_db: SessionTesting):
     user = User(**test_user)
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    seed_db.add(user)
+    seed_db.commit()
+    seed_db.refresh(user)
     yield
-    db.delete(user)
-    db.commit()
+    seed_db.delete(user)
+    seed_db.commit()
 
 
 def test_get_user_by_id(db: SessionTesting, client: TestClient):
     response = client.get("/api/user/test_user")
     assert response.status_code == 200
-    assert response.json() == test_user
+    assert response.json() == test_user_in_db
+
+
+def test_get_user_by_id_without_orm(db: SessionTesting, client: TestClient):
+    loaded = []
+
+    def load(target, context):
+        loaded.append(target)
+
+    crud.user.cache.clear()
+    event.listen(User, "load", load)
+    try:
+        for _ in range(2):
+            response = client.get("/api/user/test_user")
+            assert response.status_code == 200
+            assert response.json() == test_user_in_db
+    finally:
+        event.remove(User, "load", load)
+    assert loaded == []
+
+
+def test_get_user_fields(db: SessionTesting, client: TestClient, statements):
+    crud.user.cache.clear()
+    statements.clear()
+    response = client.get(
+        "/api/user/test_user", params={"fields": ["f_name", "image", "f_name"]}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"f_name": "Test", "image": "https://test.com/image.jpg"}
+    assert len(statements) == 1 and "email" not in statements[0]
+
+    # Projected from the cached record
+    client.get("/api/user/test_user")
+    response = client.get("/api/user/test_user", params={"fields": ["tags"]})
+    assert response.json() == {"tags": ["test"]}
+
+    response = client.get("/api/user/test_user", params={"fields": ["password"]})
+    assert response.status_code == 400
+
+
+def test_get_public_user(db: SessionTesting, client: TestClient):
+    response = client.get("/api/user/test_user/public")
+    assert response.status_code == 200
+    assert response.json() == {
+        "uid": "test_user",
+        "f_name": "Test",
+        "l_name": "User",
+        "image": "https://test.com/image.jpg",
+        "images": test_user_in_db["images"],
+    }
+    assert client.get("/api/user/missing_user/public").status_code == 404
+
+
+def test_get_user_images(
+    db: SessionTesting, seed_db: SessionTesting, client: TestClient
+):
+    image = "/static/user/users/test_user/0123456789abcdef0123456789abcdef.jpg"
+    user = seed_db.get(User, "test_user")
+    user.image = image
+    seed_db.commit()
+    crud.user.cache.clear()
+
+    # The same variant URLs as the responses of the ORM paths
+    expected = UserInDB.model_validate(user, from_attributes=True).images
+    assert expected["thumb"] != image
+    assert client.get("/api/user/test_user").json()["images"] == expected
+    assert client.get("/api/user/test_user/public").json()["images"] == expected
+
+
+def test_get_users_by_id(db: SessionTesting, client: TestClient):
+    response = client.post(
+        "/api/user/batch", json={"ids": ["test_user", "missing_user", "test_user"]}
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert [user["uid"] for user in body["users"]] == ["test_user"]
+    assert body["missing"] == ["missing_user"]
+
+
+admin = AuthData(sub="admin", name="Admin", scopes=[ScopeEnum.ADMIN], tags=[])
+
+
+@pytest.mark.parametrize("client", [admin], indirect=True)
+def test_list_users(db: SessionTesting, seed_db: SessionTesting, client: TestClient):
+    others = [
+        User(**{**test_user, "uid": f"test_user_{i}", "email": f"test{i}@email.com"})
+        for i in range(3)
+    ]
+    seed_db.add_all(others)
+    seed_db.commit()
+    try:
+        uids, cursor = [], None
+        while True:
+            params = {"limit": 2, "tags": ["test"]}
+            if cursor:
+                params["cursor"] = cursor
+            response = client.get("/api/user/", params=params)
+            assert response.status_code == 200
+            page = response.json()
+            uids += [user["uid"] for user in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert uids == ["test_user", "test_user_0", "test_user_1", "test_user_2"]
+
+        response = client.get("/api/user/", params={"roles": ["admin"]})
+        assert response.json() == {"items": [], "next_cursor": None}
+
+        response = client.get("/api/user/", params={"cursor": "not a cursor"})
+        assert response.status_code == 400
+    finally:
+        for user in others:
+            seed_db.delete(user)
+        seed_db.commit()
+
+
+provider = AuthData(
+    sub="provider", name="Provider", scopes=[ScopeEnum.PROVIDER], tags=[]
+)
+
+
+@pytest.mark.parametrize("client", [provider], indirect=True)
+def test_search_users(db: SessionTesting, seed_db: SessionTesting, client: TestClient):
+    other = User(
+        **{**test_user, "uid": "test_user_0", "email": "test0@email.com"},
+    )
+    other.tags = ["test", "other"]
+    seed_db.add(other)
+    seed_db.commit()
+    try:
+        response = client.get("/api/user/search", params={"tags": ["test", "other"]})
+        assert response.status_code == 200
+        # Contact details are for admins only
+        assert response.json()["items"] == [
+            {
+                "uid": "test_user_0",
+                "f_name": test_user["f_name"],
+                "l_name": test_user["l_name"],
+                "image": test_user["image"],
+                "images": test_user_in_db["images"],
+            }
+        ]
+
+        response = client.get("/api/user/search")
+        assert response.status_code == 400
+
+        response = client.get(
+            "/api/user/search", params={"tags": ["other", "none"], "match": "any"}
+        )
+        assert [user["uid"] for user in response.json()["items"]] == ["test_user_0"]
+
+        response = client.get(
+            "/api/user/search", params={"tags": ["test", "none"], "match": "any"}
+        )
+        assert [user["uid"] for user in response.json()["items"]] == [
+            "test_user",
+            "test_user_0",
+        ]
+    finally:
+        seed_db.delete(other)
+        seed_db.commit()
+
+
+@pytest.mark.parametrize("client", [admin], indirect=True)
+@pytest.mark.parametrize(
+    "value",
+    [1, "test_user", {"uid": "test_user"}, [], [1], [True], ["a", "b"], ["\x00"]],
+)
+@pytest.mark.parametrize("path", ["/api/user/", "/api/user/search"])
+def test_crafted_cursor(client: TestClient, path: str, value):
+    cursor = urlsafe_b64encode(json.dumps(value).encode()).decode()
+    response = client.get(path, params={"tags": ["test"], "cursor": cursor})
+    assert response.status_code == 400
+
+    cursor = urlsafe_b64encode(json.dumps(["test_user"]).encode()).decode()
+    response = client.get(path, params={"tags": ["test"], "cursor": cursor})
+    assert response.json() == {"items": [], "next_cursor": None}
+
+
+@pytest.mark.parametrize("client", [admin], indirect=True)
+def test_search_users_as_admin(client: TestClient):
+    response = client.get("/api/user/search", params={"tags": ["test"]})
+    assert response.status_code == 200
+    (user,) = response.json()["items"]
+    assert user["email"] == test_user["email"]
+    assert user["phone_number"] == test_user["phone_number"]
+
+
+me = AuthData(sub="test_user", name="Test User", scopes=[ScopeEnum.USER], tags=[])
+
+
+@pytest.mark.parametrize("client", [me], indirect=True)
+def test_update_me(
+    db: SessionTesting, seed_db: SessionTesting, client: TestClient, statements
+):
+    fields = ("email", "f_name", "l_name", "phone_number", "tags")
+    update = {field: test_user[field] for field in fields}
+    # Nothing changes, nothing is written
+    statements.clear()
+    response = client.put("/api/user/me", data={"user": json.dumps(update)})
+    assert response.status_code == 200
+    assert len(statements) == 1
+
+    statements.clear()
+    update.update(f_name="Changed", tags=["test", "other"])
+    response = client.put("/api/user/me", data={"user": json.dumps(update)})
+    assert response.status_code == 200
+    assert response.json()["f_name"] == "Changed"
+    assert response.json()["tags"] == ["test", "other"]
+    # The lookup, the UPDATE ... RETURNING and the cache invalidation
+    assert len(statements) == 3
+    [stmt] = [stmt for stmt in statements if stmt.startswith("UPDATE")]
+    assert "RETURNING" in stmt and "email" not in stmt.split("WHERE")[0]
+    seed_db.expire_all()
+    assert seed_db.get(User, "test_user").f_name == "Changed"
+
+
+def _png(color) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 200), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("client", [me], indirect=True)
+def test_update_me_image(client: TestClient, tmp_path, monkeypatch):
+    # Images are stored under the working directory, by threads sharing it
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(crud_user, "image_pool", ImagePool(workers=0, queue_size=1))
+    update = {
+        field: test_user[field]
+        for field in ("email", "f_name", "l_name", "phone_number", "tags")
+    }
+
+    def upload(data: bytes) -> dict:
+        response = client.put(
+            "/api/user/me",
+            data={"user": json.dumps(update)},
+            files={"image": ("image.png", data, "image/png")},
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    first = upload(_png("red"))
+    assert first["image"].startswith("/static/user/users/test_user/")
+    assert first["images"]["thumb"] == first["image"].replace(".jpg", "_thumb.webp")
+    original = tmp_path / first["image"].lstrip("/")
+    assert Image.open(original).format == "JPEG"
+    # As if a variant had been rendered
+    variant = tmp_path / first["images"]["thumb"].lstrip("/")
+    variant.write_bytes(b"")
+
+    second = upload(_png("blue"))
+    assert second["image"] != first["image"]
+    assert (tmp_path / second["image"].lstrip("/")).exists()
+    assert not original.exists() and not variant.exists()
+
+    response = client.put(
+        "/api/user/me",
+        data={"user": json.dumps(update)},
+        files={"image": ("image.png", b"not an image", "image/png")},
+    )
+    assert response.status_code == 400
+
+
+def test_sync_update_keeps_returned_row(seed_db: SessionTesting, statements):
+    user = seed_db.get(User, "test_user")
+    statements.clear()
+    crud.user.update(seed_db, db_obj=user, obj_in={"f_name": "Changed"})
+    # Read back without loading the expired object again
+    assert user.f_name == "Changed" and user.email == test_user["email"]
+
+    # The UPDATE ... RETURNING and the cache invalidation
+    assert len(statements) == 2
+
+
+missing = AuthData(sub="missing_user", name="Missing", scopes=[ScopeEnum.USER], tags=[])
+
+
+@pytest.mark.parametrize("client", [missing], indirect=True)
+def test_update_missing_me(db: SessionTesting, client: TestClient):
+    update = {field: None for field in ("email", "f_name", "l_name", "phone_number")}
+    response = client.put(
+        "/api/user/me", data={"user": json.dumps({**update, "tags": []})}
+    )
+    assert response.status_code == 404
+
+
+def test_concurrent_registrations(
+    seed_db: SessionTesting, client: TestClient, monkeypatch: pytest.MonkeyPatch
+):
+    registrations = 16
+    commits = []
+
+    def commit(conn):
+        commits.append(conn)
+
+    with FirebaseStub() as stub:
+        monkeypatch.setattr(auth_deps, "firebase_keys", FirebaseKeyStore(stub.url))
+        token = stub.mint_token("register_user")
+
+        def register(_):
+            return client.post(
+                "/api/user/register",
+                headers={"Authorization": f"Bearer {token}"},
+                json={
+                    "first_name": "Register",
+                    "last_name": "User",
+                    "email": "register@email.com",
+                    "roles": ["user"],
+                    "tags": [],
+                },
+            )
+
+        event.listen(Engine, "commit", commit)
+        try:
+            with ThreadPoolExecutor(max_workers=registrations) as pool:
+                responses = list(pool.map(register, range(registrations)))
+        finally:
+            event.remove(Engine, "commit", commit)
+
+    try:
+        statuses = sorted(response.status_code for response in responses)
+        assert statuses == [200] + [400] * (registrations - 1)
+        # The user and its session in a single transaction
+        assert len(commits) == 1
+        assert seed_db.get(User, "register_user") is not None
+        sessions = seed_db.query(DeviceLogin).filter_by(user_id="register_user")
+        assert sessions.count() == 1
+    finally:
+        seed_db.query(User).filter_by(uid="register_user").delete()
+        seed_db.commit()
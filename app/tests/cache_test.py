@@ -0,0 +1,52 @@
+import time
+
+from app.cache import Denylist, TTLCache
+
+
+def test_lru_eviction():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_expiration():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1, ttl=0.01)
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_stale_set_is_skipped():
+    cache = TTLCache(max_entries=2, ttl=60)
+    version = cache.version
+    cache.invalidate("a")
+    cache.set("a", "stale", version=version)
+
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_denylist_keeps_keys_until_expiry():
+    denylist = Denylist()
+    for i in range(1000):
+        denylist.add(i, ttl=60)
+    denylist.add("short", ttl=0.01)
+    denylist.add("expired", ttl=0)
+
+    assert all(i in denylist for i in range(1000))
+    assert "short" in denylist and "expired" not in denylist
+
+    time.sleep(0.02)
+    assert "short" not in denylist
+    # Pruned as new keys come in
+    denylist.add("new", ttl=60)
+    assert len(denylist) == 1001
@@ -8,14 +8,17 @@ from fastapi.testclient import TestClient
 from fastapi.responses import ORJSONResponse
 from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.schema import CreateSchema
 from alembic import command, config
 from app.utils import ROOT_DIR
 
 from app.api.auth_deps import get_auth_data, AuthData
-from app.api.deps import get_db
+from app.api.deps import get_async_db, get_db
 from app.api import router as api_v1_router
+from app.api import well_known
 from core.config import settings
 from db.base_class import Base
 
@@ -33,6 +36,13 @@ from app.schemas.user import ScopeEnum
 engine = create_engine(settings.TEST_POSTGRES_URI)
 SessionTesting = sessionmaker(engine, autoflush=False)
 
+# Connections can't be shared between event loops and the `TestClient` runs
+# the app in its own loop, so the async engine must not pool connections.
+async_engine = create_async_engine(settings.TEST_ASYNC_POSTGRES_URI, poolclass=NullPool)
+AsyncSessionTesting = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 
 @pytest.fixture(scope="session")
 def connection():
@@ -40,7 +50,7 @@ def connection():
 
     This only executes once for all tests.
     """
-    last_known_revision = "e63d7af6ac9f"
+    last_known_revision = "9132d716c92f"
     with engine.connect() as conn:
         cfg = config.Config(f"{ROOT_DIR}/alembic.ini")
         cfg.attributes["connection"] = conn
@@ -66,12 +76,26 @@ def db(connection: Connection) -> Generator[Session, Any, None]:
     transaction.rollback()
 
 
+@pytest.fixture(scope="function")
+def seed_db(connection: Connection) -> Generator[Session, Any, None]:
+    """Session whose commits are visible to the app.
+
+    The app talks to the database through its own async connections, so
+    data it must see has to be really committed. Tests are responsible for
+    removing what they add.
+    """
+    session = SessionTesting()
+    yield session
+    session.close()
+
+
 @pytest.fixture(scope="session")
 def app() -> Generator[FastAPI, Any, None]:
     """Create a new application for the test session."""
 
     _app = FastAPI(default_response_class=ORJSONResponse)
     _app.include_router(api_v1_router, prefix=settings.API_V1_STR)
+    _app.include_router(well_known.router)
     yield _app
 
 
@@ -95,7 +119,13 @@ def client(
         finally:
             pass
 
+    async def _get_test_async_db():
+        async with AsyncSessionTesting() as async_db:
+            yield async_db
+            await async_db.commit()
+
     app.dependency_overrides[get_db] = _get_test_db
+    app.dependency_overrides[get_async_db] = _get_test_async_db
     if auth_data:
         app.dependency_overrides[get_auth_data] = pass_trough_auth
 
@@ -103,3 +133,16 @@ def client(
         yield client
 
     app.dependency_overrides.clear()
+
+
+@pytest.fixture(scope="function")
+def statements() -> Generator[list[str], Any, None]:
+    """Record the SQL statements executed by any engine during the test."""
+    statements: list[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(Engine, "before_cursor_execute", before_cursor_execute)
@@ -0,0 +1,112 @@
+"""Local stand-in for the Google x509 endpoint that serves Firebase keys.
+
+Also mints Firebase-shaped ID tokens signed with the stand-in key so the
+`/register` and `/login` flows can be exercised without touching Google.
+"""
+
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from app.core.config import settings
+
+KEY_ID = "stand-in-key"
+
+
+def _self_signed_cert(key: rsa.RSAPrivateKey) -> str:
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    return cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class FirebaseStub:
+    """Serves `{kid: certificate}` over HTTP like the Google metadata endpoint."""
+
+    def __init__(self, *, max_age: int = 3600, port: int = 0):
+        self.max_age = max_age
+        self.port = port
+        self.requests = 0
+        # Set to an error status to simulate an outage
+        self.status = 200
+        self.private_key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048
+        )
+        self.certs = {KEY_ID: _self_signed_cert(self.private_key)}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None, "Stand-in server is not running"
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "FirebaseStub":
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                if stub.status != 200:
+                    self.send_error(stub.status)
+                    return
+                body = json.dumps(stub.certs).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", f"public, max-age={stub.max_age}")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FirebaseStub":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def mint_token(self, uid: str, **claims: Any) -> str:
+        """Mint an ID token shaped like the ones issued by Firebase Auth."""
+        now = int(datetime.now(timezone.utc).timestamp())
+        payload: Dict[str, Any] = {
+            "iss": f"https://securetoken.google.com/{settings.FIREBASE_PROJECT_ID}",
+            "aud": settings.FIREBASE_PROJECT_ID,
+            "auth_time": now,
+            "user_id": uid,
+            "sub": uid,
+            "iat": now,
+            "exp": now + 3600,
+        }
+        payload.update(claims)
+        return jwt.encode(
+            payload, self.private_key, algorithm="RS256", headers={"kid": KEY_ID}
+        )
@@ -0,0 +1,177 @@
+import asyncio
+import io
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from app.core.config import settings
+from app.exception import ServiceBusyException
+from app.images import (
+    ImagePool,
+    parse_variant,
+    process_profile_image,
+    remove_profile_image,
+    render_variant,
+    variant_urls,
+)
+
+MD5 = "0123456789abcdef0123456789abcdef"
+
+
+def _image(fmt: str = "PNG", size=(320, 240)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 80, 40)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def _exit_once(marker: str) -> int:
+    # Kills the worker the first time, like an out of memory kill would
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    return os.getpid()
+
+
+def _exit() -> None:
+    os._exit(1)
+
+
+def test_pool_returns_timings(tmp_path):
+    pool = ImagePool(workers=0, queue_size=0)
+    dest = tmp_path / "image.jpg"
+
+    async def run():
+        return await pool.run(process_profile_image, _image(), str(dest))
+
+    try:
+        timings = asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert set(timings) == {"decode", "transpose", "convert", "encode"}
+    assert all(t >= 0 for t in timings.values())
+    assert Image.open(dest).format == "JPEG"
+    assert pool.pending == 0
+
+
+def test_pool_rejects_when_saturated():
+    pool = ImagePool(workers=0, queue_size=1)
+    release = threading.Event()
+
+    async def run():
+        jobs = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(ServiceBusyException):
+            await pool.run(release.wait)
+
+        # A cancelled request doesn't free its slot while the job still runs
+        jobs[0].cancel()
+        await asyncio.sleep(0.05)
+        assert pool.pending == 2
+        with pytest.raises(ServiceBusyException):
+            await pool.run(release.wait)
+
+        release.set()
+        await asyncio.wait(jobs)
+        await asyncio.sleep(0.05)
+        assert pool.pending == 0
+        assert await pool.run(release.wait)
+
+    try:
+        asyncio.run(run())
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_pool_recovers_from_dead_worker(tmp_path):
+    pool = ImagePool(workers=1, queue_size=0)
+
+    async def run():
+        # Retried once in a new pool
+        pid = await pool.run(_exit_once, str(tmp_path / "marker"))
+        assert pid != os.getpid()
+
+        with pytest.raises(ServiceBusyException):
+            await pool.run(_exit)
+        assert pool.pending == 0
+        assert await pool.run(_exit_once, str(tmp_path / "marker")) != pid
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.parametrize("fmt", ["JPEG", "WEBP"])
+def test_render_variant(tmp_path, fmt: str):
+    src = str(tmp_path / f"{MD5}.jpg")
+    process_profile_image(_image("JPEG", size=(1600, 1200)), src)
+
+    for name, size in settings.IMAGE_VARIANTS.items():
+        dest = str(tmp_path / f"{MD5}_{name}")
+        timings = render_variant(src, dest, size, fmt)
+        assert set(timings) == {"decode", "resize", "encode"}
+        with Image.open(dest) as img:
+            assert img.format == fmt
+            assert img.size == (size, size * 3 // 4)
+
+    # Never upscaled
+    render_variant(src, str(tmp_path / "large"), 2048, fmt)
+    assert Image.open(tmp_path / "large").size == (1600, 1200)
+
+
+def test_parse_variant(monkeypatch):
+    original = f"user/users/test_user/{MD5}.jpg"
+    assert parse_variant(f"user/users/test_user/{MD5}_thumb.webp") == (
+        original,
+        "thumb",
+        settings.IMAGE_VARIANTS["thumb"],
+        "WEBP",
+    )
+    assert parse_variant(f"user/users/test_user/{MD5}_full.jpg") == (
+        original,
+        "full",
+        settings.IMAGE_VARIANTS["full"],
+        "JPEG",
+    )
+    assert parse_variant(f"user/users/test_user/{MD5}_huge.jpg") is None
+    assert parse_variant(f"user/users/test_user/{MD5}.jpg") is None
+    assert parse_variant(f"user/users/test_user/{MD5}_thumb.png") is None
+
+    monkeypatch.setattr(settings, "IMAGE_WEBP", False)
+    assert parse_variant(f"user/users/test_user/{MD5}_thumb.webp") is None
+    assert parse_variant(f"user/users/test_user/{MD5}_thumb.jpg") is not None
+
+
+def test_variant_urls(monkeypatch):
+    image = f"/static/user/users/test_user/{MD5}.jpg"
+    assert variant_urls(image) == {
+        name: f"/static/user/users/test_user/{MD5}_{name}.webp"
+        for name in settings.IMAGE_VARIANTS
+    }
+    assert variant_urls(settings.DEFAULT_USER_IMAGE) == {
+        name: settings.DEFAULT_USER_IMAGE for name in settings.IMAGE_VARIANTS
+    }
+
+    monkeypatch.setattr(settings, "IMAGE_WEBP", False)
+    assert variant_urls(image)["thumb"] == (
+        f"/static/user/users/test_user/{MD5}_thumb.jpg"
+    )
+
+
+def test_remove_profile_image(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    directory = tmp_path / "static" / "user" / "users" / "test_user"
+    directory.mkdir(parents=True)
+    other = "f" * 32
+    for name in [f"{MD5}.jpg", f"{MD5}_thumb.webp", f"{MD5}_full.jpg", f"{other}.jpg"]:
+        (directory / name).write_bytes(b"")
+
+    remove_profile_image(f"/static/user/users/test_user/{MD5}.jpg")
+    assert os.listdir(directory) == [f"{other}.jpg"]
+
+    # Images that aren't stored here are left alone
+    remove_profile_image(settings.DEFAULT_USER_IMAGE)
+    assert os.listdir(directory) == [f"{other}.jpg"]
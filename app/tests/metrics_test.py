@@ -0,0 +1,73 @@
+import asyncio
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+
+from app.core.config import settings
+from app.metrics import MetricsMiddleware, observe_statements, timed
+
+
+def _sample(name: str, labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_request_latency_by_route():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def get_item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=404)
+        return {}
+
+    labels = {"method": "GET", "route": "/items/{item_id}", "status": "200"}
+    missing = {**labels, "status": "404"}
+    unmatched = {"method": "GET", "route": "unmatched", "status": "404"}
+    before = [
+        _sample("http_request_duration_seconds_count", labels)
+        for labels in (labels, missing, unmatched)
+    ]
+
+    client = TestClient(app)
+    for path in ("/items/1", "/items/2", "/items/0", "/nowhere"):
+        client.get(path)
+
+    assert _sample("http_request_duration_seconds_count", labels) == before[0] + 2
+    assert _sample("http_request_duration_seconds_count", missing) == before[1] + 1
+    assert _sample("http_request_duration_seconds_count", unmatched) == before[2] + 1
+
+
+def test_statement_latency():
+    engine = create_engine(settings.TEST_POSTGRES_URI)
+    observe_statements(engine, "metrics_test")
+    labels = {"engine": "metrics_test", "statement": "SELECT"}
+
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        try:
+            conn.execute(text("SELECT * FROM nowhere"))
+        except Exception:
+            conn.rollback()
+        conn.execute(text("SELECT 2"))
+    engine.dispose()
+
+    assert _sample("db_statement_duration_seconds_count", labels) == 2
+
+
+def test_timed():
+    @timed("metrics_test")
+    def operation():
+        return 1
+
+    @timed("metrics_test")
+    async def async_operation():
+        return 2
+
+    assert operation() == 1
+    assert asyncio.run(async_operation()) == 2
+
+    labels = {"operation": "metrics_test"}
+    assert _sample("operation_duration_seconds_count", labels) == 2
@@ -0,0 +1,64 @@
+import asyncio
+
+import asyncpg
+
+from app.cache import TTLCache
+from app.core.config import settings
+from app.db.notify import (
+    APPLICATION_NAME,
+    CHANNEL,
+    InvalidationListener,
+    notify_payload,
+    register_cache,
+)
+
+TABLE = "notify_test"
+
+
+async def _wait_for(condition, timeout: float = 5) -> None:
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_invalidation_across_connections():
+    cache = TTLCache(max_entries=10, ttl=60)
+    register_cache(TABLE, cache)
+
+    async def run():
+        listener = InvalidationListener(settings.TEST_POSTGRES_URI, min_backoff=0.1)
+        listener.start()
+        await asyncio.wait_for(listener.connected.wait(), 5)
+
+        conn = await asyncpg.connect(settings.TEST_POSTGRES_URI)
+        try:
+            cache.set("a", 1)
+            cache.set(("b", 1), 2)
+            async with conn.transaction():
+                for key in ("a", ("b", 1)):
+                    await conn.execute(
+                        "SELECT pg_notify($1, $2)", CHANNEL, notify_payload(TABLE, key)
+                    )
+                # Nothing is delivered before the commit
+                await asyncio.sleep(0.1)
+                assert cache.get("a") == 1
+
+            await _wait_for(lambda: len(cache) == 0)
+
+            # Notifications sent while disconnected are lost, so reconnecting
+            # flushes everything.
+            cache.set("c", 3)
+            await conn.execute(
+                "SELECT pg_terminate_backend(pid) FROM pg_stat_activity"
+                " WHERE application_name = $1",
+                APPLICATION_NAME,
+            )
+            await _wait_for(lambda: len(cache) == 0)
+            await asyncio.wait_for(listener.connected.wait(), 5)
+        finally:
+            await conn.close()
+            await listener.stop()
+
+    asyncio.run(run())
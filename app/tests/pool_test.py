@@ -0,0 +1,39 @@
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+
+from app.core.config import settings
+from app.db.pool import TimedQueuePool, pool_collector
+
+
+def _sample(name: str) -> float:
+    return REGISTRY.get_sample_value(name, {"pool": "pool_test"}) or 0
+
+
+def test_pool_metrics():
+    engine = create_engine(
+        settings.TEST_POSTGRES_URI,
+        poolclass=TimedQueuePool,
+        pool_logging_name="pool_test",
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    pool_collector.register(engine)
+    waits = _sample("db_pool_wait_seconds_count")
+
+    try:
+        with engine.connect():
+            assert _sample("db_pool_checked_out") == 1
+            assert _sample("db_pool_size") == 1
+
+            with pytest.raises(TimeoutError):
+                engine.connect()
+            assert _sample("db_pool_timeouts_total") == 1
+            assert _sample("db_pool_wait_seconds_sum") >= 0.1
+
+        assert _sample("db_pool_checked_out") == 0
+        assert _sample("db_pool_wait_seconds_count") == waits + 2
+    finally:
+        engine.dispose()
@@ -0,0 +1,73 @@
+import jwt
+import pytest
+from fastapi.testclient import TestClient
+from jwt.algorithms import RSAAlgorithm
+
+from app.api import auth_deps
+from app.core.signing import TokenError, TokenSigner, generate_keys, public_jwk
+
+
+@pytest.mark.parametrize("algorithm", ["RS256", "ES256", "EdDSA"])
+def test_sign_and_verify(algorithm: str):
+    signer = TokenSigner(algorithm, *generate_keys(algorithm))
+    token = signer.sign({"sub": "some_user", "iat": 0, "exp": 2**32})
+
+    assert signer.verify(token, require=["sub"])["sub"] == "some_user"
+    with pytest.raises(TokenError):
+        signer.verify(token, require=["sid"])
+
+
+def test_foreign_token_is_rejected():
+    signer = TokenSigner("ES256", *generate_keys("ES256"))
+    other = TokenSigner("ES256", *generate_keys("ES256"))
+
+    with pytest.raises(TokenError):
+        signer.verify(other.sign({"sub": "some_user"}))
+
+
+def test_mismatched_keys():
+    private_key, _ = generate_keys("ES256")
+    _, public_key = generate_keys("ES256")
+    with pytest.raises(ValueError):
+        TokenSigner("ES256", private_key, public_key)
+
+    with pytest.raises(ValueError):
+        TokenSigner("HS256", b"secret", b"secret")
+
+
+def test_key_rotation():
+    old_private, old_public = generate_keys("RS256")
+    new_private, new_public = generate_keys("ES256")
+    old = TokenSigner("RS256", old_private, old_public)
+    new = TokenSigner("ES256", new_private, new_public, keyring=[old_public])
+
+    token = old.sign({"sub": "some_user"})
+    assert new.verify(token)["sub"] == "some_user"
+    assert [key["kid"] for key in new.jwks["keys"]] == [new.kid, old.kid]
+    with pytest.raises(TokenError):
+        old.verify(new.sign({"sub": "some_user"}))
+
+
+def test_kid_is_jwk_thumbprint():
+    # RFC 7638, section 3.1
+    jwk = {
+        "kty": "RSA",
+        "n": "0vx7agoebGcQSuuPiLJXZptN9nndrQmbXEps2aiAFbWhM78LhWx4cbbfAAtVT86zwu1RK7aPFFxuhDR1L6tSoc_BJECPebWKRXjBZCiFV4n3oknjhMstn64tZ_2W-5JsGY4Hc5n9yBXArwl93lqt7_RN5w6Cf0h4QyQ5v-65YGjQR0_FDW2QvzqY368QQMicAtaSqzs8KJZgnYb9c7d0zgdAZHzu6qMQvRL5hajrn1n91CbOpbISD08qNLyrdkt-bFTWhAI4vMQFh6WeZu0fM4lFd2NcRwr3XPksINHaQ-G_xBniIqbw0Ls1jF44-csFCur-kEgU8awapJzKnqDKgw",
+        "e": "AQAB",
+    }
+    key = RSAAlgorithm.from_jwk(jwk)
+    assert (
+        public_jwk("RS256", key)["kid"] == "NzbLsXh8uDCcd-6MNwXF4W_7noWXFZAfHkxZsRGC9Xs"
+    )
+
+
+def test_jwks_endpoint(client: TestClient):
+    response = client.get("/.well-known/jwks.json")
+    assert response.status_code == 200
+    assert response.headers["cache-control"].startswith("public, max-age=")
+
+    (jwk,) = response.json()["keys"]
+    token = auth_deps.create_token({"sub": "some_user"})
+    assert jwt.get_unverified_header(token)["kid"] == jwk["kid"]
+    key = RSAAlgorithm.from_jwk(jwk)
+    assert jwt.decode(token, key, algorithms=[jwk["alg"]])["sub"] == "some_user"
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from app.db.sweeper import sweep_sessions
+from app.models.device_login import DeviceLogin
+from app.models.user import User
+from app.tests.conftest import SessionTesting, async_engine
+
+
+def test_sweep_sessions(seed_db: SessionTesting):
+    user = User(
+        uid="sweeper_user",
+        email="sweeper@email.com",
+        f_name="Sweeper",
+        l_name="User",
+        image="https://test.com/image.jpg",
+    )
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    seed_db.add(user)
+    seed_db.commit()
+    seed_db.add_all(
+        DeviceLogin(
+            user_id=user.uid,
+            session_id=session_id,
+            refreshed_at=now,
+            expires_at=now + timedelta(hours=1 if session_id < 2 else -1),
+        )
+        for session_id in range(7)
+    )
+    seed_db.commit()
+    try:
+        purged = asyncio.run(sweep_sessions(async_engine, batch_size=2, pause=0))
+        assert purged == 5
+
+        seed_db.expire_all()
+        remaining = seed_db.scalars(select(DeviceLogin.session_id)).all()
+        assert sorted(remaining) == [0, 1]
+    finally:
+        seed_db.delete(user)
+        seed_db.commit()
@@ -0,0 +1,151 @@
+import asyncio
+import io
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from app.api.auth_deps import AuthData
+from app.db.user_import import ImportSummary, import_users, read_ndjson
+from app.models.user import User
+from app.schemas.user import ScopeEnum
+from app.tests.conftest import SessionTesting, async_engine
+
+CSV = """uid,email,f_name,l_name,roles,verified,tags,phone_number
+import_1,import1@email.com,First,User,"user,provider",true,"a, b",
+import_2,import2@email.com,Second,User,user,false,,123
+import_3,import3@email.com,Third,User,user,maybe,,
+import_4,import1@email.com,Fourth,User,user,true,,
+import_5,import5@email.com,Fifth,User,user,true,,123456789012345
+import_0,import6@email.com,Taken,User,user,true,,
+"""
+
+
+@pytest.fixture(autouse=True)
+def setup_database(seed_db: SessionTesting):
+    seed_db.add(
+        User(
+            uid="import_0",
+            email="import0@email.com",
+            f_name="Existing",
+            l_name="User",
+            image="https://test.com/image.jpg",
+        )
+    )
+    seed_db.commit()
+    yield
+    seed_db.query(User).filter(User.uid.like("import_%")).delete()
+    seed_db.commit()
+
+
+admin = AuthData(sub="admin", name="Admin", scopes=[ScopeEnum.ADMIN], tags=[])
+
+
+@pytest.mark.parametrize("client", [admin], indirect=True)
+def test_bulk_import(seed_db: SessionTesting, client: TestClient):
+    response = client.post(
+        "/api/user/import", content=CSV, headers={"Content-Type": "text/csv"}
+    )
+    assert response.status_code == 200
+    *errors, summary = map(orjson.loads, response.content.splitlines())
+    assert summary == {"rows": 6, "imported": 2, "failed": 4}
+    assert [(error["line"], error["uid"]) for error in errors] == [
+        (4, "import_3"),
+        (5, "import_4"),
+        (6, "import_5"),
+        (7, "import_0"),
+    ]
+
+    user = seed_db.get(User, "import_1")
+    assert user.roles == ["user", "provider"] and user.tags == ["a", "b"]
+    assert user.phone_number is None
+    assert seed_db.get(User, "import_0").f_name == "Existing"
+
+    response = client.post(
+        "/api/user/import", content=CSV, headers={"Content-Type": "text/plain"}
+    )
+    assert response.status_code == 400
+
+
+def test_import_users_in_chunks(seed_db: SessionTesting):
+    lines = [
+        orjson.dumps(
+            {
+                "uid": f"import_{i}",
+                "email": f"import{i}@email.com",
+                "f_name": "Imported",
+                "l_name": "User",
+                "verified": True,
+                "tags": [],
+            }
+        ).decode()
+        for i in range(1, 8)
+    ]
+    lines.insert(3, "not json")
+
+    async def run(summary: ImportSummary):
+        rows = read_ndjson(io.BytesIO("\n".join(lines).encode()))
+        return [
+            error
+            async for error in import_users(async_engine, rows, summary, chunk_size=3)
+        ]
+
+    summary = ImportSummary()
+    errors = asyncio.run(run(summary))
+    assert [error.line for error in errors] == [4]
+    assert summary == ImportSummary(rows=8, imported=7, failed=1)
+    uids = seed_db.scalars(select(User.uid).where(User.uid.like("import_%"))).all()
+    assert len(uids) == 8
+
+
+def _user(i: int, **fields) -> dict:
+    return {
+        "uid": f"import_{i}",
+        "email": f"import{i}@email.com",
+        "f_name": "Imported",
+        "l_name": "User",
+        "verified": True,
+        "tags": [],
+        **fields,
+    }
+
+
+@pytest.mark.parametrize("client", [admin], indirect=True)
+def test_bulk_import_rejects_nul_and_bad_utf8(
+    seed_db: SessionTesting, client: TestClient
+):
+    ndjson = b"\n".join(
+        [
+            orjson.dumps(_user(1)),
+            orjson.dumps(_user(2, f_name="A\u0000")),
+            orjson.dumps(_user(3, tags=["a\u0000"])),
+            orjson.dumps(_user(4)).replace(b"Imported", b"Imp\xffrted"),
+            orjson.dumps(_user(5)),
+        ]
+    )
+    response = client.post(
+        "/api/user/import",
+        content=ndjson,
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    *errors, summary = map(orjson.loads, response.content.splitlines())
+    assert summary == {"rows": 5, "imported": 2, "failed": 3}
+    assert [error["line"] for error in errors] == [2, 3, 4]
+
+    csv = (
+        "uid,email,f_name,l_name,verified,tags\n"
+        "import_6,import6@email.com,Six,User,true,\n"
+        "import_7,import7@email.com,S\xffven,User,true,\n"
+        "import_8,import8@email.com,Eight,User,true,\n"
+    ).encode("latin-1")
+    response = client.post(
+        "/api/user/import", content=csv, headers={"Content-Type": "text/csv"}
+    )
+    *errors, summary = map(orjson.loads, response.content.splitlines())
+    assert summary == {"rows": 3, "imported": 2, "failed": 1}
+    assert [(error["line"], error["uid"]) for error in errors] == [(3, "import_7")]
+
+    uids = seed_db.scalars(select(User.uid).where(User.uid.like("import_%"))).all()
+    assert sorted(uids) == ["import_0", "import_1", "import_5", "import_6", "import_8"]
@@ -1,7 +1,8 @@
 from pathlib import Path
-from pydantic import model_validator
+from pydantic import BaseModel, model_validator
 import json
-from typing import Any
+import orjson
+from typing import Any, Callable, Mapping, Type
 
 # DO NOT MOVE THIS FILE
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -20,3 +21,32 @@ class ValidateFromJson:
         if isinstance(data, dict):
             return data
         return json.loads(data)
+
+
+def record_serializer(
+    schema: Type[BaseModel], **computed: Callable[[Mapping[str, Any]], Any]
+) -> Callable[[Mapping[str, Any]], bytes]:
+    """JSON encoder of plain records with the fields of `schema`.
+
+    The fields are looked up once, here. Records are expected to hold
+    JSON-native values, as read from the database, so unlike a response model
+    nothing is validated or converted: the fields are picked in order and
+    handed to orjson. Keys of the record that `schema` lacks are left out.
+    The computed fields of `schema` are given by `computed`, each as a
+    function of the record.
+    """
+    fields = tuple(schema.model_fields)
+    if set(computed) != set(schema.model_computed_fields):
+        raise ValueError(
+            f"Computed fields of {schema.__name__}: "
+            f"{', '.join(schema.model_computed_fields) or 'none'}"
+        )
+    extra = tuple(computed.items())
+
+    def serialize(record: Mapping[str, Any]) -> bytes:
+        data = {field: record[field] for field in fields}
+        for field, compute in extra:
+            data[field] = compute(record)
+        return orjson.dumps(data)
+
+    return serialize
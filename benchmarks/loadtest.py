@@ -0,0 +1,330 @@
+"""Load test of the user endpoints.
+
+Firebase is replaced by the local stand-in of `app.tests.firebase_stub`,
+which serves the x509 certificates and mints the ID tokens. Postgres is the
+one the settings point at, e.g. `docker compose -f compose.test.yml up db_pg`
+with `POSTGRES_DB=user_db_test`.
+
+Unless `--base-url` is given, the app is started with uvicorn, configured to
+fetch its Firebase keys from the stand-in. Virtual users are registered, then
+every worker drives its own share of them through a weighted mix of
+operations for `--duration` seconds. Results are printed (or written to
+`--output`) as JSON, to be compared across commits:
+
+    python -m benchmarks.loadtest --concurrency 32 --duration 30 \\
+        --mix login=1,refresh=4,get=10,put=1 --output results.json
+"""
+
+import argparse
+import asyncio
+import glob
+import io
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Dict, List, Optional
+
+import httpx
+import orjson
+from PIL import Image
+from sqlalchemy import create_engine, delete
+
+from app.core.config import settings
+from app.models.user import User
+from app.tests.firebase_stub import FirebaseStub
+
+API = settings.API_V1_STR + "/user"
+OPERATIONS = ("login", "refresh", "get", "put")
+
+
+@dataclass
+class VirtualUser:
+    uid: str
+    id_token: str
+    access_token: str = ""
+    refresh_token: str = ""
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, users: List[VirtualUser], args):
+        self.client = client
+        self.users = users
+        self.args = args
+        self.image: Optional[bytes] = None
+        if args.put_image:
+            buffer = io.BytesIO()
+            Image.new("RGB", (800, 600), "teal").save(buffer, "JPEG")
+            self.image = buffer.getvalue()
+        self.reset()
+
+    def reset(self) -> None:
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.errors: Dict[str, int] = {op: 0 for op in OPERATIONS}
+
+    def _store_tokens(self, user: VirtualUser, response: httpx.Response) -> None:
+        user.access_token = response.json()["access_token"]
+        user.refresh_token = response.cookies["refresh"]
+
+    async def register(self, user: VirtualUser) -> None:
+        response = await self.client.post(
+            f"{API}/register",
+            headers={"Authorization": f"Bearer {user.id_token}"},
+            json={
+                "first_name": "Load",
+                "last_name": "Test",
+                "email": f"{user.uid}@load.invalid",
+                "roles": ["user"],
+                "tags": ["load"],
+            },
+        )
+        response.raise_for_status()
+        self._store_tokens(user, response)
+
+    async def login(self, user: VirtualUser) -> httpx.Response:
+        response = await self.client.post(
+            f"{API}/login", headers={"Authorization": f"Bearer {user.id_token}"}
+        )
+        if response.status_code == 200:
+            self._store_tokens(user, response)
+        return response
+
+    async def refresh(self, user: VirtualUser) -> httpx.Response:
+        response = await self.client.post(
+            f"{API}/refresh", headers={"Cookie": f"refresh={user.refresh_token}"}
+        )
+        if response.status_code == 200:
+            self._store_tokens(user, response)
+        return response
+
+    async def get(self, user: VirtualUser) -> httpx.Response:
+        other = random.choice(self.users)
+        return await self.client.get(f"{API}/{other.uid}")
+
+    async def put(self, user: VirtualUser) -> httpx.Response:
+        update = {
+            "email": f"{user.uid}@load.invalid",
+            "f_name": random.choice(("Load", "Stress", "Soak")),
+            "l_name": "Test",
+            "phone_number": None,
+            "tags": ["load"],
+        }
+        files = None
+        if self.image is not None:
+            files = {"image": ("avatar.jpg", self.image, "image/jpeg")}
+        return await self.client.put(
+            f"{API}/me",
+            headers={"Authorization": f"Bearer {user.access_token}"},
+            data={"user": orjson.dumps(update).decode()},
+            files=files,
+        )
+
+    async def worker(self, users: List[VirtualUser], deadline: float) -> None:
+        # Each worker owns its users: concurrent refreshes of one session
+        # would look like a replayed token
+        ops = list(self.args.mix)
+        weights = list(self.args.mix.values())
+        i = 0
+        while time.perf_counter() < deadline:
+            user = users[i % len(users)]
+            i += 1
+            op = random.choices(ops, weights)[0]
+            start = time.perf_counter()
+            try:
+                response = await getattr(self, op)(user)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                self.latencies[op].append(time.perf_counter() - start)
+            else:
+                self.errors[op] += 1
+
+    async def run(self, duration: float) -> float:
+        concurrency = self.args.concurrency
+        shares = [self.users[i::concurrency] for i in range(concurrency)]
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(self.worker(share, start + duration) for share in shares if share)
+        )
+        return time.perf_counter() - start
+
+
+def _percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(p / 100 * (len(sorted_values) - 1)))
+    return round(sorted_values[index] * 1000, 3)
+
+
+def _summary(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 2),
+        "p50_ms": _percentile(values, 50),
+        "p95_ms": _percentile(values, 95),
+        "p99_ms": _percentile(values, 99),
+    }
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        op, _, weight = part.partition("=")
+        if op not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation "{op}"')
+        mix[op] = float(weight or 1)
+    return mix
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _start_server(stub: FirebaseStub, workers: int) -> tuple:
+    port = _free_port()
+    env = {**os.environ, "FIREBASE_CERTS_URL": stub.url}
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"{base_url}/metrics").raise_for_status()
+            return server, base_url
+        except httpx.HTTPError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("The app didn't start")
+
+
+async def _main(args, stub: FirebaseStub, base_url: str) -> Dict:
+    run_id = uuid.uuid4().hex[:8]
+    users = [
+        VirtualUser(uid, stub.mint_token(uid))
+        for uid in (f"load_{run_id}_{i}" for i in range(args.users))
+    ]
+    # Cookies are sent by hand, each virtual user has its own
+    cookies = CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, cookies=cookies, limits=limits, timeout=30
+    ) as client:
+        test = LoadTest(client, users, args)
+        for i in range(0, len(users), args.concurrency):
+            await asyncio.gather(
+                *(test.register(user) for user in users[i : i + args.concurrency])
+            )
+        if args.warmup:
+            await test.run(args.warmup)
+            test.reset()
+        elapsed = await test.run(args.duration)
+
+    if not args.keep_users:
+        engine = create_engine(settings.POSTGRES_URI)
+        with engine.begin() as conn:
+            conn.execute(delete(User).where(User.uid.like(f"load_{run_id}_%")))
+        engine.dispose()
+        if args.base_url is None:
+            for path in glob.glob(f"static/user/users/load_{run_id}_*"):
+                shutil.rmtree(path)
+
+    all_latencies = [value for values in test.latencies.values() for value in values]
+    return {
+        "commit": _commit(),
+        "config": {
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": args.mix,
+            "put_image": args.put_image,
+            "server_workers": None if args.base_url else args.workers,
+        },
+        "elapsed_s": round(elapsed, 3),
+        "operations": {
+            op: _summary(test.latencies[op], test.errors[op], elapsed)
+            for op in args.mix
+        },
+        "total": _summary(all_latencies, sum(test.errors.values()), elapsed),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--base-url",
+        help="Test a running app instead, its FIREBASE_CERTS_URL must be "
+        "http://127.0.0.1:<stub port>/",
+    )
+    parser.add_argument("--stub-port", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument(
+        "--mix", type=_parse_mix, default=_parse_mix("login=1,refresh=4,get=10,put=1")
+    )
+    parser.add_argument("--put-image", action="store_true")
+    parser.add_argument("--keep-users", action="store_true")
+    parser.add_argument("--output", help="File to write the results to")
+    args = parser.parse_args()
+    if args.users < args.concurrency:
+        parser.error("--users must be at least --concurrency")
+
+    with FirebaseStub(port=args.stub_port) as stub:
+        server = None
+        base_url = args.base_url
+        if base_url is None:
+            server, base_url = _start_server(stub, args.workers)
+        try:
+            results = asyncio.run(_main(args, stub, base_url))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    output = orjson.dumps(results, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(output)
+    else:
+        sys.stdout.buffer.write(output + b"\n")
+
+
+if __name__ == "__main__":
+    main()
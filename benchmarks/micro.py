@@ -0,0 +1,265 @@
+"""Microbenchmarks of the auth and CRUD hot paths, checked against a baseline.
+
+Every benchmark reports the best per-call time out of `--repeat` runs of a
+batch sized to last at least `--min-time`. The results are compared with
+the baseline file and the run fails if any is slower by more than
+`--threshold` percent; `--update` rewrites the baseline instead. Timings are
+only comparable on the same machine, refresh the baseline there first.
+
+The benchmarks that touch the database use the one the settings point at,
+e.g. with `POSTGRES_DB=user_db_test`. A user is created for the run and
+removed afterwards, along with its sessions and images.
+
+    python -m benchmarks.micro --update
+    python -m benchmarks.micro --threshold 15 -k token
+"""
+
+import argparse
+import asyncio
+import inspect
+import io
+import json
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.security import HTTPAuthorizationCredentials
+from loguru import logger
+from PIL import Image
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import crud
+from app.api import auth_deps
+from app.core.config import settings
+from app.crud.base import CRUDBase, _primary_key
+from app.db.init_db import init_db
+from app.db.session import AsyncSessionLocal, SessionLocal, async_engine, engine
+from app.images import image_pool
+from app.models.user import User
+
+BASELINE = "benchmarks/micro_baseline.json"
+UID = "bench_micro_user"
+
+
+def _access_payload() -> Dict[str, Any]:
+    iat = datetime.now(timezone.utc)
+    return {
+        "sub": UID,
+        "name": "Bench User",
+        "scopes": ["user"],
+        "tags": ["tag1", "tag2"],
+        "type": auth_deps.ACCESS_TOKEN_TYPE,
+        "iat": iat,
+        "exp": iat + settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+        "image": settings.DEFAULT_USER_IMAGE,
+    }
+
+
+def _image(fmt: str, size=(1600, 1200)) -> bytes:
+    """A smooth, photo-like image, the same on every run"""
+    rng = random.Random(0)
+    img = Image.frombytes("RGB", (16, 12), rng.randbytes(16 * 12 * 3))
+    img = img.resize(size, Image.Resampling.BICUBIC)
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+async def _benchmarks(db: Session, adb: AsyncSession) -> Dict[str, Callable[[], Any]]:
+    """Functions to time, by name, those returning an awaitable are awaited"""
+    # One instance per session, an object can't be attached to both
+    user = db.get(User, UID)
+    auser = await adb.get(User, UID)
+    token = auth_deps.create_token(_access_payload())
+    cred = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    def get_auth_data_uncached():
+        auth_deps.access_tokens.clear()
+        return auth_deps.get_auth_data(cred)
+
+    names = ["Bench", "Benched"]
+
+    def update():
+        # Alternate the name so that every call writes
+        names.reverse()
+        return CRUDBase.update(crud.user, db, db_obj=user, obj_in={"f_name": names[0]})
+
+    def update_image(data: bytes):
+        return lambda: crud.user.update_image(adb, db_obj=auser, image=data)
+
+    user_key = crud.user.primary_key
+    session_key = crud.device_login.primary_key
+    return {
+        "create_token": lambda: auth_deps.create_token(_access_payload()),
+        "decode_token": lambda: auth_deps.decode_token(token),
+        "get_auth_data (cached)": lambda: auth_deps.get_auth_data(cred),
+        "get_auth_data (uncached)": get_auth_data_uncached,
+        "generate_response": lambda: auth_deps.generate_response(adb, auser),
+        "_primary_key (single)": lambda: _primary_key("User", UID, user_key),
+        "_primary_key (composite)": lambda: _primary_key(
+            "DeviceLogin", (UID, 1), session_key
+        ),
+        "CRUDBase.update": update,
+        "update_image (jpeg)": update_image(_image("JPEG")),
+        "update_image (png)": update_image(_image("PNG")),
+    }
+
+
+async def _per_call_us(fn: Callable[[], Any], repeat: int, min_time: float) -> float:
+    async def batch(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            result = fn()
+            if inspect.isawaitable(result):
+                await result
+        return time.perf_counter() - start
+
+    number = 1
+    while (elapsed := await batch(number)) < min_time:
+        number *= min(10, max(2, int(min_time / max(elapsed, 1e-9))))
+    timings = [elapsed] + [await batch(number) for _ in range(repeat - 1)]
+    return min(timings) / number * 1e6
+
+
+def _setup() -> None:
+    init_db()
+    _cleanup()
+    with SessionLocal() as db:
+        db.add(
+            User(
+                uid=UID,
+                email="bench_micro@bench.invalid",
+                f_name="Bench",
+                l_name="User",
+                roles=["user"],
+                verified=True,
+                tags=["tag1", "tag2"],
+                image=settings.DEFAULT_USER_IMAGE,
+            )
+        )
+        db.commit()
+
+
+def _cleanup() -> None:
+    # Sessions go along with the user
+    with engine.begin() as conn:
+        conn.execute(delete(User).where(User.uid == UID))
+    shutil.rmtree(f"static/user/users/{UID}", ignore_errors=True)
+
+
+async def run(args) -> Dict[str, float]:
+    results = {}
+    _setup()
+    try:
+        with SessionLocal() as db:
+            async with AsyncSessionLocal() as adb:
+                for name, fn in (await _benchmarks(db, adb)).items():
+                    if args.k and not any(k in name for k in args.k):
+                        continue
+                    results[name] = round(
+                        await _per_call_us(fn, args.repeat, args.min_time), 2
+                    )
+                    print(f"{name:<28}{results[name]:>14.2f} µs", file=sys.stderr)
+    finally:
+        _cleanup()
+        image_pool.shutdown()
+        await async_engine.dispose()
+    return results
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(
+    results: Dict[str, float], baseline: Dict[str, float], threshold: float
+) -> List[str]:
+    """Names of the benchmarks more than `threshold` percent slower"""
+    return [
+        name
+        for name, us in results.items()
+        if name in baseline and us > baseline[name] * (1 + threshold / 100)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20,
+        help="slowdown allowed, in percent of the baseline",
+    )
+    parser.add_argument("--update", action="store_true", help="rewrite the baseline")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument(
+        "-k", action="append", help="only run benchmarks whose name contains this"
+    )
+    args = parser.parse_args()
+
+    # The per stage timings of update_image are logged at DEBUG
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    results = asyncio.run(run(args))
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results_us"]
+    except FileNotFoundError:
+        if not args.update:
+            raise
+        baseline = {}
+
+    if args.update:
+        # Benchmarks left out with -k keep their previous value
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "commit": _commit(),
+                    "machine": f"{platform.machine()} {platform.processor()}".strip(),
+                    "python": platform.python_version(),
+                    "results_us": baseline,
+                },
+                f,
+                indent=2,
+                ensure_ascii=False,
+            )
+            f.write("\n")
+        return
+
+    print(f"{'benchmark':<28}{'baseline µs':>14}{'now µs':>14}{'change':>10}")
+    for name, us in results.items():
+        if name in baseline:
+            change = f"{(us / baseline[name] - 1) * 100:+.1f}%"
+            print(f"{name:<28}{baseline[name]:>14.2f}{us:>14.2f}{change:>10}")
+        else:
+            print(f"{name:<28}{'-':>14}{us:>14.2f}{'new':>10}")
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        sys.exit(
+            f"Slower than the baseline by more than {args.threshold:g}%: "
+            + ", ".join(regressions)
+        )
+
+
+if __name__ == "__main__":
+    main()
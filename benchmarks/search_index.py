@@ -0,0 +1,133 @@
+"""Check that tag and role searches stay index-backed on a large table.
+
+Seeds the test database with synthetic users, then runs the queries built by
+`crud.user.filters` under EXPLAIN ANALYZE and reports their plan and timing.
+A search fails the run unless its plan reads the GIN index of a filtered
+array, and if it does a sequential scan or a filtered walk of the primary
+key. The seeded rows are removed afterwards.
+
+    python -m benchmarks.search_index --rows 2000000
+"""
+
+import argparse
+import json
+import time
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.dialects import postgresql
+
+from app import crud
+from app.core.config import settings
+from app.models.user import User
+from app.schemas.user import MatchEnum
+
+PREFIX = "bench_"
+TAGS = 500
+ROLES = ["user", "provider", "admin"]
+
+SEED = text(f"""
+    INSERT INTO {settings.SCHEMA_NAME}."user"
+        (id, email, f_name, l_name, roles, verified, tags, image)
+    SELECT
+        :prefix || n,
+        :prefix || n || '@bench.invalid',
+        'Bench', 'User',
+        ARRAY[(:roles)[1 + n % 3]],
+        n % 2 = 0,
+        ARRAY['tag' || n % :tags, 'tag' || (n / 7) % :tags, 'tag' || (n / 13) % :tags],
+        '/static/user/-1/default.png'
+    FROM generate_series(1, :rows) AS n
+    """)
+
+QUERIES = {
+    "tags all": dict(tags=["tag1", "tag2"]),
+    "tags any": dict(tags=["tag1", "tag2"], match=MatchEnum.ANY),
+    "roles all": dict(roles=["admin"]),
+    "tags and roles": dict(tags=["tag3"], roles=["provider"]),
+    "no match": dict(tags=["nope"], roles=["user"]),
+}
+# The GIN index of each filtered array
+INDEXES = {"tags": "ix_user_tags", "roles": "ix_user_roles"}
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--uri", default=settings.TEST_POSTGRES_URI)
+    args = parser.parse_args()
+
+    engine = create_engine(args.uri)
+    with engine.begin() as conn:
+        start = time.perf_counter()
+        conn.execute(SEED, dict(prefix=PREFIX, roles=ROLES, tags=TAGS, rows=args.rows))
+        conn.execute(text(f'ANALYZE {settings.SCHEMA_NAME}."user"'))
+        print(f"seeded {args.rows} users in {time.perf_counter() - start:.1f}s")
+
+    failed = False
+    try:
+        with engine.connect() as conn:
+            for name, kwargs in QUERIES.items():
+                stmt = crud.user._get_multi_stmt(
+                    None, args.limit, crud.user.filters(**kwargs), False
+                )
+                sql = str(
+                    stmt.compile(
+                        dialect=postgresql.dialect(),
+                        compile_kwargs={"literal_binds": True},
+                    )
+                )
+                count = conn.scalar(
+                    select(func.count())
+                    .select_from(User)
+                    .where(*crud.user.filters(**kwargs))
+                )
+                explain = conn.scalar(
+                    text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+                )[0]
+                indexes = {
+                    node["Index Name"]
+                    for node in _plan_nodes(explain["Plan"])
+                    if "Index Name" in node
+                }
+                seq_scan = any(
+                    node["Node Type"] == "Seq Scan"
+                    for node in _plan_nodes(explain["Plan"])
+                )
+                # Rows read in key order and dropped until enough match
+                pk_filtered = any(
+                    node.get("Index Name") == "pk_user" and "Filter" in node
+                    for node in _plan_nodes(explain["Plan"])
+                )
+                gin = bool(indexes & {INDEXES[key] for key in kwargs if key in INDEXES})
+                failed |= seq_scan or pk_filtered or not gin
+                print(
+                    json.dumps(
+                        {
+                            "query": name,
+                            "matches": count,
+                            "execution_ms": explain["Execution Time"],
+                            "indexes": sorted(indexes),
+                            "seq_scan": seq_scan,
+                            "pk_filtered": pk_filtered,
+                        }
+                    )
+                )
+    finally:
+        with engine.begin() as conn:
+            conn.execute(
+                text(f'DELETE FROM {settings.SCHEMA_NAME}."user" WHERE id LIKE :p'),
+                dict(p=PREFIX + "%"),
+            )
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
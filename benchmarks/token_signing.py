@@ -0,0 +1,70 @@
+"""Compare the cost of signing and verifying tokens per JWT algorithm.
+
+Keys are generated for the run. "parsed" uses `TokenSigner` (keys loaded
+once), "pem" hands the PEM text to PyJWT on every call, as
+`create_token`/`decode_token` used to.
+
+    python -m benchmarks.token_signing
+"""
+
+import argparse
+import timeit
+from datetime import datetime, timezone
+
+import jwt
+
+from app.core.config import settings
+from app.core.signing import ALGORITHMS, TokenSigner, generate_keys
+
+
+def _payload():
+    iat = datetime.now(timezone.utc)
+    return {
+        "sub": "bench_user_0000000000000000000",
+        "name": "Bench User",
+        "scopes": ["user"],
+        "tags": ["tag1", "tag2"],
+        "type": "access",
+        "iat": iat,
+        "exp": iat + settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+    }
+
+
+def _per_call_us(fn, repeat: int) -> float:
+    number, _ = timeit.Timer(fn).autorange()
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = _payload()
+    print(f"{'algorithm':<10}{'keys':<8}{'sign µs':>12}{'verify µs':>12}")
+    for algorithm in ALGORITHMS:
+        private_pem, public_pem = generate_keys(algorithm)
+        signer = TokenSigner(algorithm, private_pem, public_pem)
+        token = signer.sign(payload)
+        rows = [
+            (
+                "parsed",
+                lambda: signer.sign(payload),
+                lambda: signer.verify(token),
+            ),
+            (
+                "pem",
+                lambda: jwt.encode(payload, private_pem, algorithm=algorithm),
+                lambda: jwt.decode(token, public_pem, algorithms=[algorithm]),
+            ),
+        ]
+        for keys, sign, verify in rows:
+            print(
+                f"{algorithm:<10}{keys:<8}"
+                f"{_per_call_us(sign, args.repeat):>12.1f}"
+                f"{_per_call_us(verify, args.repeat):>12.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
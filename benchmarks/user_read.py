@@ -0,0 +1,77 @@
+"""Per-request cost of reading a user, ORM and generic encoding vs plain rows.
+
+"orm" loads the `User` instance, turns it into a dict and encodes it the way
+FastAPI does for an endpoint without a response model (`jsonable_encoder`,
+then `ORJSONResponse`), as `GET /api/user/{user_id}` used to. "rows" selects
+the columns as a plain row and encodes it with `serialize_user_record`, as
+it does now. "cached" only covers the encoding of a record already in the
+cache. Each query runs in a session of its own, like a request.
+
+Uses the database the settings point at, e.g. with `POSTGRES_DB=user_db_test`.
+
+    python -m benchmarks.user_read
+"""
+
+import argparse
+import asyncio
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, Response
+
+from app import crud
+from app.db.session import AsyncSessionLocal, async_engine
+from app.schemas.user import serialize_user_record
+from benchmarks.micro import UID, _cleanup, _per_call_us, _setup
+
+
+async def orm() -> Response:
+    async with AsyncSessionLocal() as db:
+        record = crud.user.to_record(await crud.user.aget(db, UID))
+    return ORJSONResponse(jsonable_encoder(record))
+
+
+async def rows() -> Response:
+    async with AsyncSessionLocal() as db:
+        record = await crud.user._aselect_record(db, UID)
+    return Response(serialize_user_record(record), media_type="application/json")
+
+
+async def run(args) -> None:
+    _setup()
+    try:
+        async with AsyncSessionLocal() as db:
+            record = await crud.user._aselect_record(db, UID)
+        # The rows path adds the variant URLs the ORM path lacked
+        assert orjson.loads((await orm()).body) == {
+            key: value
+            for key, value in orjson.loads((await rows()).body).items()
+            if key != "images"
+        }
+
+        cases = {
+            ("database", "orm"): orm,
+            ("database", "rows"): rows,
+            ("cached", "orm"): lambda: ORJSONResponse(jsonable_encoder(record)),
+            ("cached", "rows"): lambda: Response(
+                serialize_user_record(record), media_type="application/json"
+            ),
+        }
+        print(f"{'read':<10}{'path':<8}{'µs/request':>12}")
+        for (read, path), fn in cases.items():
+            us = await _per_call_us(fn, args.repeat, args.min_time)
+            print(f"{read:<10}{path:<8}{us:>12.2f}")
+    finally:
+        _cleanup()
+        await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.5)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()